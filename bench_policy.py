@@ -0,0 +1,101 @@
+# Benchmark: cost of picking a message's TTL from a deletion policy
+#
+# Compares the compiled policy table against walking the rules in order of
+# precedence for every message, for chats with few and many rules:
+#   python bench_policy.py --messages 100000
+import argparse
+import itertools
+import random
+import time
+from typing import Dict, List, Optional, Tuple
+
+from aiogram.types import Message
+
+from policy import ANY, CONTENT_CLASSES, SENDER_CLASSES, ChatPolicy, content_class, sender_class
+
+CHAT_ID = -100123
+ADMIN_IDS = frozenset(range(10, 20))
+
+
+def make_message(index: int) -> Message:
+    data = {
+        "message_id": index,
+        "date": 0,
+        "chat": {"id": CHAT_ID, "type": "supergroup"},
+        "from": {"id": index % 50, "is_bot": index % 23 == 0, "first_name": "user"},
+    }
+    kind = index % 6
+    if kind == 0:
+        data["text"] = "/start"
+        data["entities"] = [{"type": "bot_command", "offset": 0, "length": 6}]
+    elif kind == 1:
+        data["photo"] = [{"file_id": "a", "file_unique_id": "b", "width": 1, "height": 1}]
+        data["caption"] = "look"
+    elif kind == 2:
+        data["sticker"] = {"file_id": "a", "file_unique_id": "b", "type": "regular", "width": 1, "height": 1,
+                           "is_animated": False, "is_video": False}
+    elif kind == 3:
+        data["new_chat_members"] = [{"id": 99, "is_bot": False, "first_name": "new"}]
+    else:
+        data["text"] = "hello there"
+    return Message(**data)
+
+
+def make_rules(count: int) -> Dict[Tuple[str, str], Optional[int]]:
+    keys = list(itertools.product(CONTENT_CLASSES + (ANY,), SENDER_CLASSES + (ANY,)))
+    random.Random(count).shuffle(keys)
+    return {key: (None if index % 7 == 0 else 30 * (index + 1)) for index, key in enumerate(keys[:count])}
+
+
+# What the table replaces: test the rules one by one, most specific first
+def rule_chain_ttl(rules: List[Tuple[str, str, Optional[int]]], message: Message, default: int) -> Optional[int]:
+    content = message.content_type
+    content = "command" if content == "text" and message.text.startswith("/") else content
+    content = {"photo": "media", "sticker": "media", "new_chat_members": "service"}.get(content, content)
+    sender = sender_class(message, ADMIN_IDS)
+    for rule_content, rule_sender, ttl in rules:
+        if rule_content in (content, ANY) and rule_sender in (sender, ANY):
+            return ttl
+    return default
+
+
+def ns_per_message(func, messages: List[Message], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter_ns()
+        for message in messages:
+            func(message)
+        best = min(best, (time.perf_counter_ns() - started) / len(messages))
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Deletion policy classification benchmark")
+    parser.add_argument("--messages", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    messages = [make_message(index) for index in range(args.messages)]
+    max_rules = (len(CONTENT_CLASSES) + 1) * (len(SENDER_CLASSES) + 1)
+    print(f"{args.messages} messages, best of {args.repeat} runs")
+    print(f"{'rules':>5}  {'compiled ns/msg':>15}  {'rule chain ns/msg':>17}  {'compile us':>10}")
+    for count in (1, 5, 10, 20, max_rules):
+        rules = make_rules(count)
+        started = time.perf_counter_ns()
+        policy = ChatPolicy(rules)
+        compile_us = (time.perf_counter_ns() - started) / 1000
+
+        def specificity(rule: Tuple[str, str, Optional[int]]) -> int:
+            return (rule[1] == ANY) * 2 + (rule[0] == ANY)
+
+        ordered = sorted(((content, sender, ttl) for (content, sender), ttl in rules.items()), key=specificity)
+        compiled = ns_per_message(
+            lambda message: policy.ttl_for(content_class(message), sender_class(message, ADMIN_IDS), 60),
+            messages, args.repeat
+        )
+        chain = ns_per_message(lambda message: rule_chain_ttl(ordered, message, 60), messages, args.repeat)
+        print(f"{count:>5}  {compiled:>15.0f}  {chain:>17.0f}  {compile_us:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
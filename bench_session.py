@@ -0,0 +1,93 @@
+# Benchmark: aiogram's default HTTP session vs the tuned session
+#
+# Fires a mix of Bot API calls at the local fake API with fixed concurrency
+# and reports requests/s and latency percentiles for both sessions:
+#   python bench_session.py --requests 5000 --concurrency 50
+import argparse
+import asyncio
+import os
+import statistics
+import time
+from typing import List
+
+from aiogram import Bot
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+from fake_api import percentile, start_fake_api_process
+from http_session import create_session
+
+
+KEYBOARD = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text=f"{minutes} min", callback_data=f"time_{minutes * 60}") for minutes in (1, 5, 10)],
+    [InlineKeyboardButton(text=f"{hours} hour", callback_data=f"time_{hours * 3600}") for hours in (6, 12, 24)],
+])
+
+
+# One request of the bot's typical mix: deletions, permission checks and keyboard edits
+async def one_request(bot: Bot, index: int):
+    kind = index % 4
+    if kind == 0:
+        await bot.send_message(-100123, "⏱️ Select a time for this message to self-destruct:", reply_markup=KEYBOARD)
+    elif kind == 1:
+        await bot.get_chat_member(-100123, index)
+    else:
+        await bot.delete_message(-100123, index)
+
+
+async def run(bot: Bot, requests: int, concurrency: int) -> List[float]:
+    latencies: List[float] = []
+    counter = iter(range(requests))
+
+    async def worker():
+        for index in counter:
+            started = time.perf_counter()
+            await one_request(bot, index)
+            latencies.append(time.perf_counter() - started)
+
+    # Warm up the connection pool before measuring
+    await asyncio.gather(*(one_request(bot, i) for i in range(concurrency)))
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Default vs tuned Bot HTTP session benchmark")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--pool-size", type=int, default=100)
+    parser.add_argument("--codec", default="auto", choices=["auto", "orjson", "json"])
+    args = parser.parse_args()
+
+    fake_api, port = start_fake_api_process(args.latency_ms / 1000)
+    api = TelegramAPIServer.from_base(f"http://127.0.0.1:{port}")
+    token = os.getenv("BOT_TOKEN", "123456:benchmark")
+
+    sessions = {
+        "default": lambda: create_session(api=api, tuned=False, timing=False),
+        "tuned": lambda: create_session(api=api, pool_size=args.pool_size, codec=args.codec, timing=False),
+    }
+    print(f"{args.requests} requests, concurrency {args.concurrency}, fake API latency {args.latency_ms}ms")
+    print(f"{'session':>8}  {'req/s':>8}  {'p50 ms':>7}  {'p95 ms':>7}  {'p99 ms':>7}")
+    for name, factory in sessions.items():
+        async def measure():
+            bot = Bot(token=token, session=factory())
+            try:
+                started = time.perf_counter()
+                latencies = await run(bot, args.requests, args.concurrency)
+                return time.perf_counter() - started, latencies
+            finally:
+                await bot.session.close()
+
+        elapsed, latencies = asyncio.run(measure())
+        print(
+            f"{name:>8}  {len(latencies) / elapsed:>8.0f}  {statistics.median(latencies) * 1000:>7.2f}  "
+            f"{percentile(latencies, 0.95) * 1000:>7.2f}  {percentile(latencies, 0.99) * 1000:>7.2f}"
+        )
+
+    fake_api.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+# Benchmark: update throughput of the sharded mode with 1..N worker processes
+#
+# Runs entirely on one machine against the local fake Bot API:
+#   python bench_sharding.py --max-workers 4 --updates 20000
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from typing import Any, Dict, List
+
+from fake_api import start_fake_api_process
+
+
+# Mix of group chatter (scheduled for deletion) and private messages (answered)
+def make_updates(count: int, chats: int, private_share: float) -> List[Dict[str, Any]]:
+    rng = random.Random(42)
+    now = int(time.time())
+    updates = []
+    for update_id in range(1, count + 1):
+        user_id = rng.randint(1, 10_000)
+        if rng.random() < private_share:
+            chat = {"id": user_id, "type": "private", "first_name": f"user{user_id}"}
+        else:
+            chat_id = -1_000_000_000_000 - rng.randrange(chats)
+            chat = {"id": chat_id, "type": "supergroup", "title": f"group{chat_id}"}
+        updates.append({
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": now,
+                "chat": chat,
+                "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+                "text": f"message {update_id}",
+            },
+        })
+    return updates
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sharded update handling throughput benchmark")
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--updates", type=int, default=20000)
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--private-share", type=float, default=0.2)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--state-db", default="", help="SQLite store to use (disabled by default)")
+    args = parser.parse_args()
+
+    fake_api, port = start_fake_api_process(args.latency_ms / 1000)
+
+    # The bot module reads its configuration on import
+    os.environ["BOT_API_URL"] = f"http://127.0.0.1:{port}"
+    os.environ["STATE_DB"] = args.state_db
+    os.environ.setdefault("BOT_TOKEN", "123456:benchmark")
+    import logging
+    import main as bot_main
+    from sharding import ShardedRunner
+    logging.disable(logging.INFO)
+
+    updates = make_updates(args.updates, args.chats, args.private_share)
+    print(f"{args.updates} updates, {args.chats} groups, {os.cpu_count()} CPU cores")
+    print(f"{'workers':>7}  {'seconds':>8}  {'updates/s':>10}  {'speedup':>7}")
+
+    baseline = None
+    for worker_count in range(1, args.max_workers + 1):
+        runner = ShardedRunner(bot_main.dp, bot_main.bot, worker_count)
+        runner.start_workers()
+
+        async def feed():
+            for raw in updates:
+                await runner.route(raw)
+
+        started = time.perf_counter()
+        asyncio.run(feed())
+        processed = runner.stop_workers()
+        elapsed = time.perf_counter() - started
+
+        if sum(processed.values()) != len(updates):
+            print(f"warning: workers processed {sum(processed.values())} of {len(updates)} updates", file=sys.stderr)
+        rate = len(updates) / elapsed
+        baseline = baseline or rate
+        print(f"{worker_count:>7}  {elapsed:>8.2f}  {rate:>10.0f}  {rate / baseline:>6.2f}x")
+
+    fake_api.terminate()
+
+
+if __name__ == "__main__":
+    main()
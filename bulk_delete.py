@@ -0,0 +1,65 @@
+# Batched message deletion with the deleteMessages Bot API method
+#
+# deleteMessages removes up to 100 messages of one chat in a single call.
+# Messages that cannot be deleted (too old, already gone) are skipped by
+# Telegram; the call only fails if none of them could be deleted.
+import asyncio
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, List, Optional, Sequence, Union
+
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.methods.base import Request, TelegramMethod
+
+import metrics
+from ratelimit import RateLimiter
+
+if TYPE_CHECKING:
+    from aiogram import Bot
+
+# Most message ids deleteMessages accepts in one call
+BATCH_SIZE = 100
+
+# Called after every batch with (messages processed so far, total)
+ProgressCallback = Callable[[int, int], Awaitable[object]]
+
+
+# Not part of the installed aiogram version yet
+class DeleteMessages(TelegramMethod[bool]):
+    __returning__ = bool
+
+    chat_id: Union[int, str]
+    message_ids: List[int]
+
+    def build_request(self, bot: "Bot") -> Request:
+        data: Dict[str, Any] = self.dict()
+        return Request(method="deleteMessages", data=data)
+
+
+def batches(message_ids: Sequence[int], size: int = BATCH_SIZE) -> List[List[int]]:
+    return [list(message_ids[start:start + size]) for start in range(0, len(message_ids), size)]
+
+
+# Delete the messages in batches paced by the limiter; returns (deleted, failed)
+async def delete_messages(bot: "Bot", chat_id: int, message_ids: Sequence[int], limiter: RateLimiter,
+                          progress: Optional[ProgressCallback] = None) -> tuple:
+    deleted = failed = processed = 0
+    for batch in batches(sorted(message_ids)):
+        while True:
+            await limiter.acquire(chat_id)
+            try:
+                await bot(DeleteMessages(chat_id=chat_id, message_ids=batch))
+                deleted += len(batch)
+                metrics.inc("bulk_delete.batches")
+            except TelegramRetryAfter as e:
+                metrics.inc("bulk_delete.retried")
+                await asyncio.sleep(e.retry_after)
+                continue
+            except TelegramBadRequest:
+                # None of the messages in this batch could be deleted
+                failed += len(batch)
+                metrics.inc("bulk_delete.failed_batches")
+            break
+        processed += len(batch)
+        if progress is not None:
+            await progress(processed, len(message_ids))
+    metrics.inc("bulk_delete.deleted", deleted)
+    return deleted, failed
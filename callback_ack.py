@@ -0,0 +1,67 @@
+# Exactly-once acknowledgement of callback queries
+#
+# Telegram shows a spinner on the tapped button until the callback query is
+# answered, and only the first answer (with its notification or alert text)
+# counts. Handlers get a CallbackAck as `ack` and call `ack.answer(...)` as soon
+# as they know what to say, before editing messages. The answer is sent in the
+# background, so the handler does not wait for it, and later calls are ignored
+# instead of costing another API call. Callbacks the handler did not answer are
+# answered by the middleware once the handler returns or fails.
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import Bot
+from aiogram.dispatcher.middlewares.base import BaseMiddleware
+from aiogram.types import CallbackQuery, TelegramObject
+
+import metrics
+
+
+class CallbackAck:
+    __slots__ = ("bot", "callback_query_id", "answered", "_task")
+
+    def __init__(self, bot: Bot, callback_query_id: str):
+        self.bot = bot
+        self.callback_query_id = callback_query_id
+        self.answered = False
+        self._task: Optional[asyncio.Task] = None
+
+    async def answer(self, text: Optional[str] = None, show_alert: bool = False):
+        if self.answered:
+            metrics.inc("callbacks.extra_answers_skipped")
+            return
+        self.answered = True
+        self._task = asyncio.create_task(
+            self.bot.answer_callback_query(self.callback_query_id, text=text, show_alert=show_alert)
+        )
+
+    # Wait for the answer to be delivered; failures are counted, not raised
+    async def wait(self):
+        if self._task is None:
+            return
+        try:
+            await self._task
+        except Exception:
+            # Usually a query that is too old to answer after a restart
+            metrics.inc("callbacks.answer_failed")
+
+
+# Inner callback query middleware providing `ack` and the fallback answer
+class CallbackAckMiddleware(BaseMiddleware):
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if not isinstance(event, CallbackQuery):
+            return await handler(event, data)
+
+        ack = data["ack"] = CallbackAck(data["bot"], event.id)
+        try:
+            return await handler(event, data)
+        finally:
+            if not ack.answered:
+                metrics.inc("callbacks.fallback_answers")
+                await ack.answer()
+            await ack.wait()
@@ -0,0 +1,205 @@
+# Catch-up draining of overdue deletions
+#
+# After a restart or a burst of 429 errors many deletions are overdue at once.
+# Instead of letting every timer fire together, overdue deletions are queued
+# here per chat, oldest first. The drainer works in rounds in which every chat
+# gets one turn: each turn deletes up to one deleteMessages batch of the chat
+# with the oldest waiting deletion among the chats that have not had their turn
+# yet. Every call goes through the rate limiter, so one huge group cannot use
+# up the whole API budget. The backlog size and an estimated time to drain it
+# are published as gauges.
+import asyncio
+import bisect
+import logging
+import math
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Iterable, List, Optional, Set, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramForbiddenError
+
+import metrics
+from bulk_delete import BATCH_SIZE, delete_messages
+from event_log import log_event
+from ratelimit import RateLimiter
+
+# Called with (chat_id, message_ids) to filter out messages that must be kept
+KeepFilter = Callable[[int, List[int]], List[int]]
+# Called with (chat_id, message_ids) once a batch was attempted or given up on
+DoneCallback = Callable[[int, List[int]], Awaitable[object]]
+# Waits the given number of seconds between retries
+Sleep = Callable[[float], Awaitable[object]]
+
+# Attempts per batch when the API call fails (network errors, server errors)
+MAX_ATTEMPTS = 5
+
+
+class CatchUpDrainer:
+    def __init__(self, bot: Bot, limiter: RateLimiter, keep: Optional[KeepFilter] = None,
+                 done: Optional[DoneCallback] = None, batch_size: int = BATCH_SIZE,
+                 max_attempts: int = MAX_ATTEMPTS, sleep: Sleep = asyncio.sleep):
+        self.bot = bot
+        self.limiter = limiter
+        self.keep = keep
+        self.done = done
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.sleep = sleep
+        # chat_id -> failed attempts of the batch at the head of its queue
+        self._failures: Dict[int, int] = {}
+        # chat_id -> deque of (due_at, message_id), oldest first
+        self._chats: Dict[int, Deque[Tuple[float, int]]] = {}
+        # Chats that had their turn in the current round
+        self._served: Set[int] = set()
+        self._size = 0
+        # A batch was taken off the queues and is being sent
+        self._busy = False
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    # Queued or in-flight deletions remain
+    @property
+    def active(self) -> bool:
+        return self._size > 0 or self._busy
+
+    def __len__(self) -> int:
+        return self._size
+
+    # Queue an overdue deletion
+    def add(self, chat_id: int, message_id: int, due_at: float):
+        queue = self._chats.get(chat_id)
+        if queue is None:
+            queue = self._chats[chat_id] = deque()
+        if queue and due_at < queue[-1][0]:
+            bisect.insort(queue, (due_at, message_id))
+        else:
+            queue.append((due_at, message_id))
+        self._size += 1
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    # Drop queued deletions (e.g. messages that were purged or pinned)
+    def discard(self, chat_id: int, message_ids: Iterable[int]):
+        queue = self._chats.get(chat_id)
+        if not queue:
+            return
+        message_ids = set(message_ids)
+        kept = deque(item for item in queue if item[1] not in message_ids)
+        self._size -= len(queue) - len(kept)
+        if kept:
+            self._chats[chat_id] = kept
+        else:
+            del self._chats[chat_id]
+        self._publish()
+
+    # Seconds until the backlog is gone at the limiter's rates
+    def eta(self) -> float:
+        if not self._size:
+            return 0.0
+        calls = [math.ceil(len(queue) / self.batch_size) for queue in self._chats.values()]
+        overall = sum(calls) / self.limiter.global_bucket.rate
+        slowest_chat = max(calls) / self.limiter.per_key_rate
+        return max(overall, slowest_chat)
+
+    def _publish(self):
+        metrics.set_gauge("catchup.backlog", self._size)
+        metrics.set_gauge("catchup.backlog_chats", len(self._chats))
+        metrics.set_gauge("catchup.eta_seconds", round(self.eta(), 1))
+
+    def start(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+            self._publish()
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        self._busy = False
+
+    def _next_batch(self) -> Tuple[int, List[Tuple[float, int]]]:
+        waiting = [chat_id for chat_id in self._chats if chat_id not in self._served]
+        if not waiting:
+            # Every chat had its turn, start the next round
+            self._served.clear()
+            waiting = list(self._chats)
+        chat_id = min(waiting, key=lambda chat: self._chats[chat][0][0])
+        self._served.add(chat_id)
+        queue = self._chats[chat_id]
+        batch = [queue.popleft() for _ in range(min(self.batch_size, len(queue)))]
+        self._size -= len(batch)
+        if not queue:
+            del self._chats[chat_id]
+        return chat_id, batch
+
+    # Put a failed batch back at the head of its chat's queue; the chat waits for the next round
+    def _requeue(self, chat_id: int, batch: List[Tuple[float, int]]):
+        queue = self._chats.get(chat_id)
+        if queue is None:
+            queue = self._chats[chat_id] = deque()
+        queue.extendleft(reversed(batch))
+        self._size += len(batch)
+
+    async def _run(self):
+        draining_since: Optional[float] = None
+        while True:
+            if not self._chats:
+                if draining_since is not None:
+                    log_event("catchup_drained", duration=round(time.monotonic() - draining_since, 3))
+                    draining_since = None
+                self._served.clear()
+                self._publish()
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            if draining_since is None:
+                draining_since = time.monotonic()
+                log_event("catchup_started", backlog=self._size, chats=len(self._chats), eta=round(self.eta(), 1))
+
+            chat_id, batch = self._next_batch()
+            self._busy = True
+            message_ids = [message_id for _, message_id in batch]
+            if self.keep is not None:
+                message_ids = self.keep(chat_id, message_ids)
+            try:
+                if message_ids:
+                    deleted, failed = await delete_messages(self.bot, chat_id, message_ids, self.limiter)
+                    metrics.inc("catchup.deleted", deleted)
+                    metrics.inc("catchup.failed", failed)
+                    # How long the oldest deletion of the batch was overdue
+                    metrics.observe("catchup.lag", max(0.0, time.time() - batch[0][0]))
+                self._failures.pop(chat_id, None)
+            except asyncio.CancelledError:
+                # Still in the store, so it is picked up again after a restart
+                raise
+            except Exception as e:
+                failures = self._failures.get(chat_id, 0) + 1
+                # The bot was removed from the chat: retrying cannot help
+                if failures < self.max_attempts and not isinstance(e, TelegramForbiddenError):
+                    self._failures[chat_id] = failures
+                    self._requeue(chat_id, batch)
+                    log_event("catchup_batch_retry", logging.WARNING, chat_id=chat_id, size=len(batch),
+                              attempt=failures, error=type(e).__name__, detail=str(e))
+                    self._busy = False
+                    self._publish()
+                    # Usually the API or the network is down for every chat, so back off
+                    await self.sleep(min(60, 2 ** failures))
+                    continue
+                self._failures.pop(chat_id, None)
+                metrics.inc("catchup.dropped", len(batch))
+                log_event("catchup_batch_dropped", logging.WARNING, chat_id=chat_id, size=len(batch),
+                          attempts=failures, error=type(e).__name__, detail=str(e))
+
+            # Attempted or given up on; either way it no longer needs to be stored
+            if self.done is not None:
+                try:
+                    await self.done(chat_id, [message_id for _, message_id in batch])
+                except Exception as e:
+                    log_event("catchup_done_failed", logging.WARNING, chat_id=chat_id, size=len(batch),
+                              error=type(e).__name__, detail=str(e))
+            self._busy = False
+            self._publish()
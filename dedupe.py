@@ -0,0 +1,72 @@
+# Idempotent update processing
+#
+# Polling restarts and webhook retries can deliver the same update twice.
+# Every bot gets a fixed-size window of recently seen update ids: slot
+# `update_id % size` holds the last id that landed there, so checking and
+# marking an id is O(1) and memory never grows.
+import time
+from array import array
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram.dispatcher.middlewares.base import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+import metrics
+
+
+class UpdateIdWindow:
+    def __init__(self, size: int = 4096, reset_after: float = 86400.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.size = max(1, size)
+        # Telegram picks a random next update_id after a week without updates,
+        # so the window starts over after a long enough quiet period
+        self.reset_after = reset_after
+        self.clock = clock
+        self._slots = array("q", [-1]) * self.size
+        self._highest = -1
+        self._last_seen = 0.0
+
+    # Returns True if the id was already seen, otherwise marks it as seen
+    def check_and_mark(self, update_id: int) -> bool:
+        now = self.clock()
+        if self._highest >= 0 and now - self._last_seen > self.reset_after:
+            self.reset()
+        self._last_seen = now
+
+        # Ids that fell out of the window have been handled long ago
+        if update_id <= self._highest - self.size:
+            return True
+        slot = update_id % self.size
+        if self._slots[slot] == update_id:
+            return True
+        self._slots[slot] = update_id
+        if update_id > self._highest:
+            self._highest = update_id
+        return False
+
+    def reset(self):
+        self._slots = array("q", [-1]) * self.size
+        self._highest = -1
+
+
+# Outer update middleware dropping duplicate updates before they are queued
+class DedupeMiddleware(BaseMiddleware):
+    def __init__(self, window_size: int = 4096):
+        self.window_size = window_size
+        self._windows: Dict[int, UpdateIdWindow] = {}
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        bot_id = data["bot"].id
+        window = self._windows.get(bot_id)
+        if window is None:
+            window = self._windows[bot_id] = UpdateIdWindow(self.window_size)
+
+        if isinstance(event, Update) and window.check_and_mark(event.update_id):
+            metrics.inc("updates.duplicates")
+            return None
+        return await handler(event, data)
@@ -0,0 +1,25 @@
+# Parsing of human-written durations such as "90", "10m" or "2h35m10s"
+import re
+
+UNITS = {"d": 86400, "h": 3600, "m": 60, "s": 1}
+
+_DURATION = re.compile(r"(\d+)\s*([dhms])", re.IGNORECASE)
+
+
+# Returns the duration in seconds; a bare number means seconds
+def parse_duration(text: str) -> int:
+    text = text.strip().replace(" ", "")
+    if text.isdigit():
+        return int(text)
+    if not text:
+        raise ValueError("empty duration")
+    seconds = 0
+    position = 0
+    for match in _DURATION.finditer(text):
+        if match.start() != position:
+            break
+        seconds += int(match.group(1)) * UNITS[match.group(2).lower()]
+        position = match.end()
+    if position != len(text):
+        raise ValueError(f"invalid duration: {text!r}")
+    return seconds
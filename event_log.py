@@ -0,0 +1,158 @@
+# Asynchronous structured logging
+#
+# Log calls on the event loop only put the record on a bounded queue; a
+# listener thread formats it as one JSON line and writes it out. High-volume
+# event types can be sampled (keep a fraction) or rate limited (keep at most N
+# per second). Warnings and errors are never sampled away.
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+from typing import Any, Dict, Optional
+
+import metrics
+
+logger = logging.getLogger("bot")
+
+# Fraction of records kept per event type (e.g. {"message_deleted": 0.1})
+_sample_rates: Dict[str, float] = {}
+# Token buckets per event type: [records per second, tokens, last refill]
+_rate_limits: Dict[str, list] = {}
+_listener: Optional[logging.handlers.QueueListener] = None
+_queue_size = 10000
+
+
+# Parse "name=value,name=value" into a dict of floats
+def parse_event_config(value: str) -> Dict[str, float]:
+    config: Dict[str, float] = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        name, _, number = item.partition("=")
+        config[name.strip()] = float(number)
+    return config
+
+
+# Decide whether a record of this event type and level should be written
+def should_log(event: str, level: int) -> bool:
+    if level >= logging.WARNING:
+        return True
+    rate = _sample_rates.get(event)
+    if rate is not None and random.random() >= rate:
+        metrics.inc(f"log.sampled_out.{event}")
+        return False
+    bucket = _rate_limits.get(event)
+    if bucket is not None:
+        per_second, tokens, refilled_at = bucket
+        now = time.monotonic()
+        tokens = min(per_second, tokens + (now - refilled_at) * per_second)
+        bucket[2] = now
+        if tokens < 1:
+            bucket[1] = tokens
+            metrics.inc(f"log.rate_limited.{event}")
+            return False
+        bucket[1] = tokens - 1
+    return True
+
+
+# Log a structured event, e.g. log_event("message_deleted", chat_id=1, message_id=2, lag=0.3)
+def log_event(event: str, level: int = logging.INFO, **fields: Any):
+    if not logger.isEnabledFor(level) or not should_log(event, level):
+        return
+    logger.log(level, event, extra={"event": event, "fields": fields})
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+        }
+        event = getattr(record, "event", None)
+        if event is not None:
+            entry["event"] = event
+            entry.update(record.fields)
+        else:
+            entry["message"] = record.getMessage()
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+# Applies sampling and rate limits to records of other libraries (e.g. aiogram)
+class _LoggerSamplingFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        if getattr(record, "event", None) is not None:
+            return True
+        return should_log(record.name, record.levelno)
+
+
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    # Formatting happens in the listener thread, not on the event loop
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.inc("log.dropped")
+
+
+# Route all logging through the queue and start the writer thread
+def setup_logging(level: int = logging.INFO, sample_rates: Optional[Dict[str, float]] = None,
+                  rate_limits: Optional[Dict[str, float]] = None, queue_size: int = 10000):
+    global _queue_size
+    _queue_size = queue_size
+    _sample_rates.clear()
+    _sample_rates.update(sample_rates or {})
+    _rate_limits.clear()
+    for event, per_second in (rate_limits or {}).items():
+        _rate_limits[event] = [per_second, per_second, time.monotonic()]
+    _start_pipeline(level)
+
+
+def _start_pipeline(level: int):
+    global _listener
+    records: queue.Queue = queue.Queue(maxsize=_queue_size)
+    queue_handler = _NonBlockingQueueHandler(records)
+    queue_handler.addFilter(_LoggerSamplingFilter())
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    writer = logging.StreamHandler(sys.stdout)
+    writer.setFormatter(JsonFormatter())
+    if _listener is not None:
+        _listener.stop()
+    _listener = logging.handlers.QueueListener(records, writer, respect_handler_level=False)
+    _listener.start()
+
+
+# Forked worker processes do not inherit the listener thread, so they get a
+# fresh queue (the parent's lock may have been held at fork time) and listener
+def _restart_after_fork():
+    global _listener
+    if _listener is not None:
+        _listener = None
+        _start_pipeline(logging.getLogger().level)
+
+
+os.register_at_fork(after_in_child=_restart_after_fork)
+
+
+# Flush queued records and stop the writer thread
+def shutdown_logging():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(shutdown_logging)
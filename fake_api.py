@@ -0,0 +1,173 @@
+# Local fake Telegram Bot API server used by the benchmarks and replays
+#
+# Run standalone with `python fake_api.py --port 8081` and point the bot at it
+# with BOT_API_URL=http://127.0.0.1:8081
+import argparse
+import asyncio
+import multiprocessing
+import socket
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from aiohttp import web
+
+BOT_USER = {"id": 1000, "is_bot": True, "first_name": "Self Destructor", "username": "fake_self_destructor_bot"}
+
+
+class FakeTelegramAPI:
+    def __init__(self, latency: float = 0.0):
+        # Artificial per-request latency in seconds
+        self.latency = latency
+        # Number of calls per API method
+        self.calls: Dict[str, int] = {}
+        self._updates: List[Dict[str, Any]] = []
+        self._updates_changed: Optional[asyncio.Condition] = None
+        self._next_message_id = 1_000_000
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8081) -> web.AppRunner:
+        runner = web.AppRunner(self.app(), access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        return runner
+
+    # Make an update available through getUpdates
+    async def push_update(self, update: Dict[str, Any]):
+        self._updates.append(update)
+        async with self._condition():
+            self._condition().notify_all()
+
+    def _condition(self) -> asyncio.Condition:
+        if self._updates_changed is None:
+            self._updates_changed = asyncio.Condition()
+        return self._updates_changed
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = dict(await request.post())
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        # aiogram takes the bot's own user id from the token, not from getMe
+        params["bot_id"] = request.match_info["token"].split(":")[0]
+        handler = getattr(self, f"api_{method.lower()}", None)
+        result = await handler(params) if handler else True
+        return web.json_response({"ok": True, "result": result})
+
+    def _message(self, chat_id: Any, text: str = "") -> Dict[str, Any]:
+        self._next_message_id += 1
+        return {
+            "message_id": self._next_message_id,
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id), "type": "supergroup" if int(chat_id) < 0 else "private"},
+            "from": BOT_USER,
+            "text": text,
+        }
+
+    async def api_getme(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        return BOT_USER
+
+    async def api_getupdates(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        offset = int(params.get("offset") or 0)
+        timeout = float(params.get("timeout") or 0)
+        self._updates = [update for update in self._updates if update["update_id"] >= offset]
+        if not self._updates and timeout:
+            async with self._condition():
+                try:
+                    await asyncio.wait_for(self._condition().wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        return self._updates[:100]
+
+    async def api_sendmessage(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        return self._message(params["chat_id"], params.get("text", ""))
+
+    async def api_editmessagetext(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        message = self._message(params.get("chat_id") or 0, params.get("text", ""))
+        message["message_id"] = int(params.get("message_id") or message["message_id"])
+        return message
+
+    # Users with an id divisible by 10 are administrators, everyone else is a member
+    async def api_getchatmember(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        user_id = int(params["user_id"])
+        if user_id in (BOT_USER["id"], int(params.get("bot_id", 0))):
+            return _administrator(BOT_USER)
+        user = {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+        if user_id % 10 == 0:
+            return _administrator(user)
+        return {"status": "member", "user": user}
+
+    async def api_getchatadministrators(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        return [
+            {"status": "creator", "user": {"id": 10, "is_bot": False, "first_name": "owner"}, "is_anonymous": False},
+            await self.api_getchatmember({"user_id": BOT_USER["id"]}),
+        ]
+
+    async def api_getchat(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        chat_id = int(params["chat_id"])
+        return {"id": chat_id, "type": "supergroup" if chat_id < 0 else "private"}
+
+
+def _administrator(user: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "status": "administrator", "user": user, "can_be_edited": False, "is_anonymous": False,
+        "can_manage_chat": True, "can_delete_messages": True, "can_manage_video_chats": True,
+        "can_restrict_members": True, "can_promote_members": False, "can_change_info": True,
+        "can_invite_users": True, "can_pin_messages": True,
+    }
+
+
+# Helpers shared by the benchmark and replay scripts
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def run_fake_api(port: int, latency: float):
+    async def serve_forever():
+        await FakeTelegramAPI(latency=latency).start("127.0.0.1", port)
+        await asyncio.Event().wait()
+
+    asyncio.run(serve_forever())
+
+
+# Start the fake API in a forked background process; returns (process, port)
+def start_fake_api_process(latency: float = 0.0) -> Tuple[multiprocessing.Process, int]:
+    port = free_port()
+    process = multiprocessing.get_context("fork").Process(target=run_fake_api, args=(port, latency), daemon=True)
+    process.start()
+    time.sleep(0.5)
+    return process, port
+
+
+def percentile(values: List[float], share: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * share))]
+
+
+async def serve(host: str, port: int, latency: float):
+    runner = await FakeTelegramAPI(latency=latency).start(host, port)
+    print(f"Fake Bot API listening on http://{host}:{port}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local fake Telegram Bot API server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port, args.latency_ms / 1000))
+    except KeyboardInterrupt:
+        pass
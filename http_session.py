@@ -0,0 +1,127 @@
+# Tuned, pooled HTTP session for the Bot client
+#
+# aiogram's default session uses an untuned aiohttp connector and the stdlib
+# JSON codec. This session sets the connection pool size, keep-alive, DNS
+# cache and timeouts explicitly, can use orjson when it is installed, and
+# reports the duration of every API call to the metrics registry.
+import asyncio
+import json
+import time
+from typing import Any, Callable, Optional, Tuple
+
+from aiohttp import ClientError, ClientSession, ClientTimeout
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.client.telegram import PRODUCTION, TelegramAPIServer
+from aiogram.exceptions import TelegramNetworkError
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import TelegramType
+
+import metrics
+
+try:
+    import orjson
+except ImportError:  # orjson is optional
+    orjson = None
+
+
+def orjson_dumps(value: Any) -> str:
+    return orjson.dumps(value).decode()
+
+
+# Returns (loads, dumps) for the requested codec: "orjson", "json" or "auto"
+def json_codec(name: str = "auto") -> Tuple[Callable[..., Any], Callable[..., str]]:
+    if name == "orjson" and orjson is None:
+        raise RuntimeError("HTTP_JSON=orjson requires the orjson package to be installed")
+    if name in ("orjson", "auto") and orjson is not None:
+        return orjson.loads, orjson_dumps
+    return json.loads, json.dumps
+
+
+# Request middleware timing every Bot API call per method
+class RequestTimingMiddleware(BaseRequestMiddleware):
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Any:
+        name = type(method).__name__
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            metrics.inc(f"api.errors.{name}.{type(e).__name__}")
+            raise
+        finally:
+            metrics.observe(f"api.{name}", time.perf_counter() - started)
+
+
+class TunedAiohttpSession(AiohttpSession):
+    def __init__(self, pool_size: int = 100, keepalive_timeout: float = 60.0, dns_cache_ttl: int = 300,
+                 connect_timeout: float = 5.0, timeout: float = 60.0, codec: str = "auto", **kwargs: Any):
+        json_loads, json_dumps = json_codec(codec)
+        super().__init__(json_loads=json_loads, json_dumps=json_dumps, timeout=timeout, **kwargs)
+        self.connect_timeout = connect_timeout
+        # Telegram is a single host, so the whole pool may go to it
+        self._connector_init.update(
+            limit=pool_size,
+            limit_per_host=pool_size,
+            keepalive_timeout=keepalive_timeout,
+            use_dns_cache=True,
+            ttl_dns_cache=dns_cache_ttl,
+        )
+
+    async def create_session(self) -> ClientSession:
+        if self._should_reset_connector:
+            await self.close()
+
+        if self._session is None or self._session.closed:
+            self._session = ClientSession(
+                connector=self._connector_type(**self._connector_init),
+                json_serialize=self.json_dumps,
+            )
+            self._should_reset_connector = False
+
+        return self._session
+
+    def _client_timeout(self, timeout: Optional[float]) -> ClientTimeout:
+        total = self.timeout if timeout is None else timeout
+        return ClientTimeout(total=total, connect=min(self.connect_timeout, total))
+
+    async def make_request(
+        self, bot: Bot, method: TelegramMethod[TelegramType], timeout: Optional[int] = None
+    ) -> TelegramType:
+        session = await self.create_session()
+
+        request = method.build_request(bot)
+        url = self.api.api_url(token=bot.token, method=request.method)
+        form = self.build_form_data(request)
+
+        try:
+            async with session.post(url, data=form, timeout=self._client_timeout(timeout)) as resp:
+                # Raw bytes go straight to the JSON decoder without a str round-trip
+                raw_result = await resp.read()
+        except asyncio.TimeoutError:
+            raise TelegramNetworkError(method=method, message="Request timeout error")
+        except ClientError as e:
+            raise TelegramNetworkError(method=method, message=f"{type(e).__name__}: {e}")
+        response = self.check_response(method=method, status_code=resp.status, content=raw_result)
+        return response.result
+
+
+# Session factory used by the bot; `tuned=False` gives aiogram's default session
+def create_session(api: TelegramAPIServer = PRODUCTION, tuned: bool = True, pool_size: int = 100,
+                   keepalive_timeout: float = 60.0, dns_cache_ttl: int = 300, connect_timeout: float = 5.0,
+                   timeout: float = 60.0, codec: str = "auto", timing: bool = True) -> AiohttpSession:
+    if tuned:
+        session = TunedAiohttpSession(
+            api=api, pool_size=pool_size, keepalive_timeout=keepalive_timeout, dns_cache_ttl=dns_cache_ttl,
+            connect_timeout=connect_timeout, timeout=timeout, codec=codec
+        )
+    else:
+        session = AiohttpSession(api=api)
+    if timing:
+        session.middleware(RequestTimingMiddleware())
+    return session
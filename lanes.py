@@ -0,0 +1,180 @@
+# Per-chat ordered worker lanes for update processing
+#
+# Every update is hashed by chat id onto one of a fixed number of lanes. Each
+# lane has a bounded queue and a single worker, so updates from one chat are
+# handled in order while different chats are handled concurrently. When a lane
+# is full, submitting blocks (pushing backpressure back to polling or webhook
+# intake) unless the update is cosmetic, in which case it is shed. Shed button
+# taps are still answered, so the button does not keep spinning.
+#
+# Handlers run after feed_update has returned, so aiogram's ErrorsMiddleware
+# no longer sees their exceptions. The lane job passes them to the router's
+# `errors` observers itself. aiogram's "Update id=... is handled" log line
+# only covers the hand-off to a lane; the time spent in the handler is
+# recorded as the `lanes.handle_time` timing instead.
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+from aiogram import Bot, Router
+from aiogram.dispatcher.event.bases import UNHANDLED, CancelHandler, SkipHandler
+from aiogram.dispatcher.middlewares.base import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+from aiogram.types.error_event import ErrorEvent
+
+import metrics
+
+Job = Callable[[], Awaitable[Any]]
+
+
+class ChatLanes:
+    def __init__(self, lane_count: int = 8, queue_size: int = 100):
+        self.lane_count = max(1, lane_count)
+        self.queue_size = max(1, queue_size)
+        self._queues: List[asyncio.Queue] = []
+        self._workers: List[asyncio.Task] = []
+
+    @property
+    def running(self) -> bool:
+        return bool(self._workers)
+
+    # Start one worker task per lane (must be called from a running event loop)
+    def start(self):
+        if self._workers:
+            return
+        for index in range(self.lane_count):
+            queue = asyncio.Queue(maxsize=self.queue_size)
+            self._queues.append(queue)
+            self._workers.append(asyncio.create_task(self._run_lane(index, queue)))
+
+    # Wait until every job accepted so far has been handled
+    async def join(self):
+        await asyncio.gather(*(queue.join() for queue in self._queues))
+
+    # Let the lanes finish already accepted work, then stop the workers
+    async def stop(self, drain_timeout: float = 10.0):
+        if not self._workers:
+            return
+        try:
+            await asyncio.wait_for(self.join(), timeout=drain_timeout)
+        except asyncio.TimeoutError:
+            logging.warning("Update lanes did not drain within %.1fs", drain_timeout)
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers.clear()
+        self._queues.clear()
+
+    def lane_for(self, key: int) -> int:
+        return key % self.lane_count
+
+    # Queue a job on the lane owning `key`; returns False if the job was shed
+    async def submit(self, key: int, job: Job, cosmetic: bool = False) -> bool:
+        if not self._workers:
+            # Lanes are not running (e.g. direct feed_update calls), run inline
+            await job()
+            return True
+
+        index = self.lane_for(key)
+        queue = self._queues[index]
+        if queue.full():
+            metrics.inc("lanes.saturated")
+            if cosmetic:
+                metrics.inc("lanes.shed")
+                return False
+
+        # Blocks while the lane is full, which slows down intake
+        await queue.put(job)
+        metrics.inc("lanes.submitted")
+        self._report_depth(index, queue)
+        return True
+
+    def depths(self) -> Dict[int, int]:
+        return {index: queue.qsize() for index, queue in enumerate(self._queues)}
+
+    def _report_depth(self, index: int, queue: asyncio.Queue):
+        depth = queue.qsize()
+        metrics.set_gauge(f"lanes.depth.{index}", depth)
+        metrics.set_gauge("lanes.depth.total", sum(q.qsize() for q in self._queues))
+        if depth > metrics.gauges.get("lanes.depth.peak", 0):
+            metrics.set_gauge("lanes.depth.peak", depth)
+
+    async def _run_lane(self, index: int, queue: asyncio.Queue):
+        while True:
+            job = await queue.get()
+            self._report_depth(index, queue)
+            try:
+                await job()
+                metrics.inc("lanes.processed")
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                metrics.inc("lanes.failed")
+                logging.exception("Unhandled error while processing update in lane %d", index)
+            finally:
+                queue.task_done()
+
+
+# Outer update middleware that moves handling of every update onto the lanes
+class LaneMiddleware(BaseMiddleware):
+    def __init__(self, lanes: ChatLanes, router: Optional[Router] = None,
+                 is_cosmetic: Optional[Callable[[Update], bool]] = None):
+        self.lanes = lanes
+        # Router whose `errors` observers receive handler exceptions (usually the dispatcher)
+        self.router = router
+        self.is_cosmetic = is_cosmetic
+        # Answers of shed callback queries that are still being sent
+        self._answers: Set[asyncio.Task] = set()
+
+    # Answer a shed callback query without waiting for it
+    def _answer_shed(self, bot: Bot, callback_query_id: str):
+        task = asyncio.create_task(bot.answer_callback_query(callback_query_id))
+        self._answers.add(task)
+        task.add_done_callback(self._answer_done)
+
+    def _answer_done(self, task: asyncio.Task):
+        self._answers.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            metrics.inc("lanes.shed_answer_failed")
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        chat = data.get("event_chat")
+        user = data.get("event_from_user")
+        key = chat.id if chat else (user.id if user else 0)
+        bot = data["bot"]
+
+        async def job():
+            # The lane worker runs outside of feed_update, restore the bot context
+            token = Bot.set_current(bot)
+            started = time.monotonic()
+            try:
+                await handler(event, data)
+            except (SkipHandler, CancelHandler):
+                pass
+            except Exception as e:
+                # Same as aiogram's ErrorsMiddleware, which has already returned by now
+                if self.router is None:
+                    raise
+                response = await self.router.propagate_event(
+                    update_type="error",
+                    event=ErrorEvent(update=event, exception=e),
+                    **data,
+                )
+                if response is UNHANDLED:
+                    raise
+            finally:
+                metrics.observe("lanes.handle_time", time.monotonic() - started)
+                Bot.reset_current(token)
+
+        cosmetic = bool(self.is_cosmetic and self.is_cosmetic(event))
+        if not await self.lanes.submit(key, job, cosmetic=cosmetic):
+            # Dropped before any handler or the callback middleware ran
+            callback_query = getattr(event, "callback_query", None)
+            if callback_query is not None:
+                self._answer_shed(bot, callback_query.id)
@@ -0,0 +1,187 @@
+# Lease-based deletion runner for running several bot replicas
+#
+# Pending deletions live in the shared store. Every replica periodically
+# claims due rows with a time-limited lease, attempts the deletion once and
+# then drops the row. If a replica dies, its leases run out and another
+# replica picks the work up within `lease_seconds`.
+#
+# Try the failover locally with two processes:
+#   python leases.py demo
+import argparse
+import asyncio
+import logging
+import os
+import socket
+import tempfile
+import time
+from typing import Awaitable, Callable, Optional, Set, Tuple
+
+from aiogram.exceptions import TelegramRetryAfter
+
+import metrics
+from event_log import log_event
+from store import StateStore
+
+DeleteCallback = Callable[[int, int], Awaitable[object]]
+
+
+def default_replica_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class LeasedDeletionRunner:
+    def __init__(self, store: StateStore, delete: DeleteCallback, owner: Optional[str] = None,
+                 lease_seconds: float = 10.0, poll_interval: float = 0.5, batch_size: int = 100):
+        self.store = store
+        self.delete = delete
+        self.owner = owner or default_replica_id()
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _store_call(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+    async def run(self):
+        while True:
+            try:
+                claimed_at = time.time()
+                claimed = await self._store_call(
+                    self.store.claim_due, self.owner, claimed_at, self.lease_seconds, self.batch_size
+                )
+            except Exception as e:
+                # The store may be locked by another replica for a moment
+                logging.warning("Failed to claim deletions: %s", e)
+                await asyncio.sleep(self.poll_interval)
+                continue
+
+            metrics.inc("leases.claimed", len(claimed))
+            lease_until = claimed_at + self.lease_seconds
+            held = {(chat_id, message_id) for chat_id, message_id, _ in claimed}
+            for index, (chat_id, message_id, due_at) in enumerate(claimed):
+                # A batch can outlast the lease; renew the rest once half of it is used,
+                # so no other replica claims rows this one is still working through
+                if time.time() > lease_until - self.lease_seconds / 2:
+                    renewed_at = time.time()
+                    held = await self._renew([row[:2] for row in claimed[index:]], renewed_at)
+                    lease_until = renewed_at + self.lease_seconds
+                if (chat_id, message_id) not in held:
+                    metrics.inc("leases.lost")
+                    continue
+                await self._attempt(chat_id, message_id, due_at)
+
+            # A full batch means more work is probably due already
+            if len(claimed) < self.batch_size:
+                await asyncio.sleep(await self._idle_delay())
+
+    # Rows of `rows` still leased by this replica (none if the store is unavailable)
+    async def _renew(self, rows, now: float) -> Set[Tuple[int, int]]:
+        try:
+            return await self._store_call(self.store.renew_leases, rows, self.owner, now, self.lease_seconds)
+        except Exception as e:
+            logging.warning("Failed to renew leases: %s", e)
+            return set()
+
+    async def _attempt(self, chat_id: int, message_id: int, due_at: float):
+        metrics.observe("leases.lag", max(0.0, time.time() - due_at))
+        try:
+            await self.delete(chat_id, message_id)
+        except TelegramRetryAfter as e:
+            # Hand the row back so whichever replica is free retries it later
+            metrics.inc("leases.retried")
+            await self._store_call(
+                self.store.release_deletion, chat_id, message_id, self.owner, time.time() + e.retry_after
+            )
+            return
+        except Exception as e:
+            log_event("message_delete_failed", logging.WARNING, chat_id=chat_id, message_id=message_id,
+                      replica=self.owner, error=type(e).__name__, detail=str(e))
+            metrics.inc("leases.failed")
+        else:
+            log_event("message_deleted", chat_id=chat_id, message_id=message_id,
+                      replica=self.owner, lag=round(time.time() - due_at, 3))
+            metrics.inc("leases.deleted")
+        await self._store_call(self.store.complete_deletion, chat_id, message_id, self.owner)
+
+    # Sleep until the next deletion is due, but keep polling for new rows
+    async def _idle_delay(self) -> float:
+        next_due = await self._store_call(self.store.next_due)
+        if next_due is None:
+            return self.poll_interval
+        return min(self.poll_interval, max(0.0, next_due - time.time()))
+
+
+# Demo replica: "deletes" by appending to a per-replica log file
+def _demo_replica(path: str, name: str, log_path: str, lease_seconds: float):
+    async def record(chat_id: int, message_id: int):
+        with open(log_path, "a") as log:
+            log.write(f"{chat_id}:{message_id}\n")
+
+    runner = LeasedDeletionRunner(StateStore(path), record, owner=name, lease_seconds=lease_seconds,
+                                  poll_interval=0.1, batch_size=10)
+    asyncio.run(runner.run())
+
+
+def demo(messages: int, lease_seconds: float):
+    import multiprocessing
+
+    workdir = tempfile.mkdtemp(prefix="lease-demo-")
+    path = os.path.join(workdir, "state.db")
+    store = StateStore(path)
+    now = time.time()
+    # Spread the deletions over a few seconds so the kill happens mid-stream
+    for message_id in range(messages):
+        store.add_deletion(-100 - message_id % 5, message_id, now + 1 + message_id * 4.0 / messages)
+
+    context = multiprocessing.get_context("spawn")
+    logs = {name: os.path.join(workdir, f"{name}.log") for name in ("replica-a", "replica-b")}
+    replicas = {
+        name: context.Process(target=_demo_replica, args=(path, name, log_path, lease_seconds))
+        for name, log_path in logs.items()
+    }
+    for replica in replicas.values():
+        replica.start()
+
+    time.sleep(2.5)
+    replicas["replica-a"].kill()
+    killed_at = time.time()
+    print("Killed replica-a after 2.5s, waiting for replica-b to take over")
+
+    while store.next_due() is not None and time.time() - killed_at < lease_seconds + 10:
+        time.sleep(0.2)
+    drained_after = time.time() - killed_at
+    replicas["replica-b"].kill()
+
+    attempts = {}
+    for name, log_path in logs.items():
+        if os.path.exists(log_path):
+            for line in open(log_path):
+                attempts.setdefault(line.strip(), []).append(name)
+    duplicates = [key for key, owners in attempts.items() if len(owners) > 1]
+    print(f"{len(attempts)}/{messages} deletions attempted, {len(duplicates)} attempted twice")
+    for name in logs:
+        print(f"  {name}: {sum(owners.count(name) for owners in attempts.values())} deletions")
+    print(f"Backlog drained {drained_after:.1f}s after the kill (lease {lease_seconds:.0f}s)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Lease-based deletion runner")
+    parser.add_argument("command", choices=["demo"])
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--lease-seconds", type=float, default=3.0)
+    args = parser.parse_args()
+    demo(args.messages, args.lease_seconds)
@@ -1,40 +1,169 @@
 import asyncio
 import logging
+import time
 from datetime import datetime, timedelta
-from typing import Dict, Any
-import aioschedule as schedule
-from aiogram import Bot, Dispatcher, types
-from aiogram.filters import Command
+from typing import Callable, Dict, Any, List, Optional, Set, Tuple
+from aiogram import Bot, Dispatcher, F, types
+from aiogram.client.telegram import PRODUCTION, TelegramAPIServer
+from aiogram.dispatcher.event.bases import SkipHandler
+from aiogram.filters import Command, CommandObject
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, Message
-from aiogram.exceptions import TelegramBadRequest
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
 from dotenv import load_dotenv
 import os
+import sys
+from lanes import ChatLanes, LaneMiddleware
+from store import StateStore
+from leases import LeasedDeletionRunner
+from http_session import create_session
+from dedupe import DedupeMiddleware
+from profiling import HandlerTimingMiddleware, Profiler
+from maintenance import MaintenanceScheduler
+from ratelimit import RateLimiter
+from bulk_delete import delete_messages
+from catchup import CatchUpDrainer
+from durations import parse_duration
+from policy import ANY, CONTENT_CLASSES, SENDER_CLASSES, ChatPolicy, content_class, sender_class
+from prewarm import prewarm
+from recorder import UpdateRecorder
+from callback_ack import CallbackAck, CallbackAckMiddleware
+from event_log import log_event, parse_event_config, setup_logging
+import metrics
 
 # Load environment variables
 load_dotenv(override=True)
 
-# Enable logging
-logging.basicConfig(level=logging.INFO)
+# Enable logging: records are written as JSON lines by a background thread.
+# High-volume events can be sampled (LOG_SAMPLE="message_deleted=0.1") or
+# rate limited per second (LOG_RATE_LIMIT="message_deleted=50"); this also
+# works with logger names such as aiogram.event. Warnings and errors are always kept.
+setup_logging(
+    level=getattr(logging, os.getenv("LOG_LEVEL", "INFO").upper()),
+    sample_rates=parse_event_config(os.getenv("LOG_SAMPLE", "")),
+    rate_limits=parse_event_config(os.getenv("LOG_RATE_LIMIT", "")),
+    queue_size=int(os.getenv("LOG_QUEUE_SIZE", "10000")),
+)
 
 # Bot configuration
 BOT_TOKEN = os.getenv("BOT_TOKEN")
+# Number of update processing lanes and the queue size of each lane
+UPDATE_LANES = int(os.getenv("UPDATE_LANES", "8"))
+LANE_QUEUE_SIZE = int(os.getenv("LANE_QUEUE_SIZE", "100"))
+# Number of recent update ids remembered to drop redelivered updates
+UPDATE_DEDUPE_WINDOW = int(os.getenv("UPDATE_DEDUPE_WINDOW", "4096"))
+# Profiling sessions started with SIGUSR1/SIGUSR2 run this long and write here
+PROFILE_SECONDS = float(os.getenv("PROFILE_SECONDS", "30"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+# How long the admin list of a group is cached, and how soon a user missing
+# from it may trigger a refresh (e.g. right after being promoted)
+ADMIN_CACHE_TTL = float(os.getenv("ADMIN_CACHE_TTL", "300"))
+ADMIN_RECHECK_SECONDS = float(os.getenv("ADMIN_RECHECK_SECONDS", "30"))
+# Concurrent API calls while warming the caches of known groups at startup (0 disables the warm-up)
+PREWARM_CONCURRENCY = int(os.getenv("PREWARM_CONCURRENCY", "8"))
+# Intervals (in seconds) of the recurring maintenance jobs
+PIN_RECONCILE_INTERVAL = float(os.getenv("PIN_RECONCILE_INTERVAL", "600"))
+CACHE_SWEEP_INTERVAL = float(os.getenv("CACHE_SWEEP_INTERVAL", "60"))
+SNAPSHOT_INTERVAL = float(os.getenv("SNAPSHOT_INTERVAL", "60"))
+METRICS_ROLLUP_INTERVAL = float(os.getenv("METRICS_ROLLUP_INTERVAL", "60"))
+# Groups checked per pinned-message reconciliation run; the next run continues where it stopped
+PIN_RECONCILE_BATCH = int(os.getenv("PIN_RECONCILE_BATCH", "50"))
+# Bot API server, e.g. the local fake API used by the benchmarks
+BOT_API_URL = os.getenv("BOT_API_URL")
+# SQLite file holding settings and pending deletions (empty to disable)
+STATE_DB = os.getenv("STATE_DB", "bot_state.db")
+# Number of worker processes; more than 1 enables the sharded deployment mode
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", "1"))
+WORKER_QUEUE_SIZE = int(os.getenv("WORKER_QUEUE_SIZE", "1000"))
+# "local" keeps deletion timers in this process, "shared" lets replicas claim
+# due deletions from the shared store with time-limited leases
+DELETION_MODE = os.getenv("DELETION_MODE", "local")
+REPLICA_ID = os.getenv("REPLICA_ID")
+DELETION_LEASE_SECONDS = float(os.getenv("DELETION_LEASE_SECONDS", "10"))
+# HTTP session tuning for Bot API calls (HTTP_TUNED=0 keeps aiogram's default session)
+HTTP_TUNED = os.getenv("HTTP_TUNED", "1") == "1"
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "100"))
+HTTP_KEEPALIVE = float(os.getenv("HTTP_KEEPALIVE", "60"))
+HTTP_DNS_TTL = int(os.getenv("HTTP_DNS_TTL", "300"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "60"))
+# JSON codec: "auto" (orjson when installed), "orjson" or "json"
+HTTP_JSON = os.getenv("HTTP_JSON", "auto")
+# Webhook intake for the sharded mode (polling is used when not set)
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+# Pacing of bulk API work such as /purge: requests per second overall and per chat
+API_RATE_LIMIT = float(os.getenv("API_RATE_LIMIT", "30"))
+CHAT_RATE_LIMIT = float(os.getenv("CHAT_RATE_LIMIT", "1"))
+# Most messages a single /purge may delete
+PURGE_LIMIT = int(os.getenv("PURGE_LIMIT", "1000"))
+# Record incoming updates (redacted, gzip JSONL) to this file for replay.py
+RECORD_UPDATES = os.getenv("RECORD_UPDATES")
 
 # Initialize bot and dispatcher
-bot = Bot(token=BOT_TOKEN)
+api_server = TelegramAPIServer.from_base(BOT_API_URL) if BOT_API_URL else PRODUCTION
+bot = Bot(token=BOT_TOKEN, session=create_session(
+    api=api_server,
+    tuned=HTTP_TUNED,
+    pool_size=HTTP_POOL_SIZE,
+    keepalive_timeout=HTTP_KEEPALIVE,
+    dns_cache_ttl=HTTP_DNS_TTL,
+    connect_timeout=HTTP_CONNECT_TIMEOUT,
+    timeout=HTTP_TIMEOUT,
+    codec=HTTP_JSON
+))
 storage = MemoryStorage()
 dp = Dispatcher(storage=storage)
+# Updates are processed in per-chat ordered lanes with bounded queues
+update_lanes = ChatLanes(lane_count=UPDATE_LANES, queue_size=LANE_QUEUE_SIZE)
 
-# Dictionary to store scheduled message deletions
-scheduled_messages: Dict[int, asyncio.Task] = {}
+# Dictionary to store scheduled message deletions (key: (chat_id, message_id))
+scheduled_messages: Dict[Tuple[int, int], asyncio.Task] = {}
 # Dictionary to store group settings (whether message deletion is enabled)
 group_settings: Dict[int, bool] = {}
 # Dictionary to store default deletion times for groups
 default_deletion_times: Dict[int, int] = {}  # Default is 60 seconds
 # Dictionary to store custom timer values for each user/chat
 custom_timers: Dict[str, int] = {}  # Key: f"{user_id}:{chat_id}", Value: seconds
+# Dictionary to store compiled deletion policies of groups that have rules
+chat_policies: Dict[int, ChatPolicy] = {}
 # Dictionary to track pinned messages to avoid deletion (key: chat_id:message_id)
 pinned_messages: set = set()
+# Dictionary caching the admin ids of each group (key: chat_id, value: (fetched_at, admin ids))
+admin_cache: Dict[int, Tuple[float, Set[int]]] = {}
+# Dictionary of whether the bot may delete messages in a group (key: chat_id, value: can_delete).
+# Filled by the startup warm-up and kept current by my_chat_member updates, so it never expires.
+bot_rights: Dict[int, bool] = {}
+# Groups that were already warned about missing delete rights
+rights_warned: Set[int] = set()
+# Startup warm-up of the caches above
+prewarm_task: asyncio.Task = None
+# Last group checked by the pinned-message reconciliation
+pin_reconcile_cursor: Optional[int] = None
+# Running /purge commands (key: chat_id)
+active_purges: Dict[int, asyncio.Task] = {}
+# Clock for cache ages and rate limiting; replay.py points it at its virtual-time event loop
+clock_source: Callable[[], float] = time.monotonic
+
+def clock() -> float:
+    return clock_source()
+
+# Paces bulk API calls under Telegram's global and per-chat limits
+api_limiter = RateLimiter(rate=API_RATE_LIMIT, burst=API_RATE_LIMIT, per_key_rate=CHAT_RATE_LIMIT, clock=clock)
+# Recurring maintenance jobs (registered at the bottom of this file)
+maintenance = MaintenanceScheduler()
+# Profiler that can be switched on at runtime (off by default)
+profiler = Profiler(output_dir=PROFILE_DIR)
+profiler.watch("scheduled_messages", lambda: len(scheduled_messages))
+profiler.watch("pinned_messages", lambda: len(pinned_messages))
+profiler.watch("custom_timers", lambda: len(custom_timers))
+profiler.watch("catchup_backlog", lambda: len(catchup_drainer))
+# Shared store for settings and pending deletions
+state_store = StateStore(STATE_DB)
+if DELETION_MODE == "shared" and not state_store.enabled:
+    raise RuntimeError("DELETION_MODE=shared requires STATE_DB to be set")
 
 # Create inline keyboard with timer options
 def get_timer_keyboard():
@@ -177,44 +306,188 @@ def get_group_settings_keyboard(chat_id: int, is_enabled: bool = None):
     ])
     return keyboard
 
+# Function to get the ids of the owner and administrators of a group (cached)
+async def get_chat_admin_ids(chat_id: int, refresh: bool = False) -> Set[int]:
+    cached = admin_cache.get(chat_id)
+    now = clock()
+    if cached is not None and not refresh and now - cached[0] < ADMIN_CACHE_TTL:
+        metrics.inc("admin_cache.hits")
+        return cached[1]
+    
+    metrics.inc("admin_cache.misses")
+    return await fetch_chat_admin_ids(chat_id)
+
+# Function to fetch and cache the admin ids of a group
+async def fetch_chat_admin_ids(chat_id: int) -> Set[int]:
+    administrators = await bot.get_chat_administrators(chat_id=chat_id)
+    admin_ids = {member.user.id for member in administrators}
+    admin_cache[chat_id] = (clock(), admin_ids)
+    return admin_ids
+
+# Function to check whether the bot may delete messages in a group without calling the API.
+# Unknown groups are assumed to allow it; a my_chat_member update corrects that.
+def bot_can_delete(chat_id: int) -> bool:
+    can_delete = bot_rights.get(chat_id)
+    if can_delete is None:
+        metrics.inc("bot_rights.misses")
+        return True
+    
+    metrics.inc("bot_rights.hits")
+    if not can_delete and chat_id not in rights_warned:
+        rights_warned.add(chat_id)
+        log_event("bot_rights_missing", logging.WARNING, chat_id=chat_id,
+                  detail="messages are not deleted until the bot may delete messages")
+    return can_delete
+
+# Function to fetch and cache the bot's own rights in a group
+async def fetch_bot_rights(chat_id: int) -> bool:
+    member = await bot.get_chat_member(chat_id=chat_id, user_id=bot.id)
+    return update_bot_rights(chat_id, member)
+
+def update_bot_rights(chat_id: int, member: types.ChatMember) -> bool:
+    can_delete = member.status == "creator" or (
+        member.status == "administrator" and bool(getattr(member, "can_delete_messages", False))
+    )
+    bot_rights[chat_id] = can_delete
+    if can_delete:
+        # Warn again if the right is taken away later
+        rights_warned.discard(chat_id)
+    return can_delete
+
 # Function to check if user has permission to change settings
 async def check_permission(chat_id: int, user_id: int) -> bool:
     try:
-        # Get chat member information
-        chat_member = await bot.get_chat_member(chat_id=chat_id, user_id=user_id)
-        
         # Allow if user is creator (owner) or administrator (moderator)
-        if chat_member.status in ["creator", "administrator"]:
+        if user_id in await get_chat_admin_ids(chat_id):
             return True
-        else:
-            return False
+        
+        # The user may have been promoted since the list was cached
+        fetched_at = admin_cache[chat_id][0]
+        if clock() - fetched_at > ADMIN_RECHECK_SECONDS:
+            return user_id in await get_chat_admin_ids(chat_id, refresh=True)
+        return False
     except Exception as e:
-        print(f"Error checking permissions: {e}")
+        log_event("permission_check_failed", logging.ERROR, chat_id=chat_id, user_id=user_id,
+                  error=type(e).__name__, detail=str(e))
+        return False
+
+# Function to persist the settings of a group in the shared store
+def persist_group_settings(chat_id: int):
+    if state_store.enabled:
+        state_store.save_settings(
+            chat_id,
+            group_settings.get(chat_id, True),
+            default_deletion_times.get(chat_id, 60)
+        )
+
+# Function to write the settings of every known group to the shared store
+def snapshot_settings():
+    if state_store.enabled:
+        state_store.save_all_settings([
+            (chat_id, group_settings.get(chat_id, True), default_deletion_times.get(chat_id, 60))
+            for chat_id in set(group_settings) | set(default_deletion_times)
+        ])
+
+# Function to start tracking a pinned message and cancel its pending deletion
+def track_pinned_message(chat_id: int, message_id: int):
+    message_key = f"{chat_id}:{message_id}"
+    pinned_messages.add(message_key)
+    log_event("pin_tracked", chat_id=chat_id, message_id=message_id)
+    
+    # Also cancel any scheduled deletion for this message if it exists
+    if (chat_id, message_id) in scheduled_messages:
+        scheduled_messages.pop((chat_id, message_id)).cancel()
+        log_event("pin_deletion_cancelled", chat_id=chat_id, message_id=message_id)
+    if state_store.enabled:
+        state_store.remove_deletion(chat_id, message_id)
+
+# Function to drop the pending deletions of messages that are being removed right away
+def cancel_pending_deletions(chat_id: int, message_ids: List[int]):
+    for message_id in message_ids:
+        task = scheduled_messages.pop((chat_id, message_id), None)
+        if task is not None:
+            task.cancel()
+    catchup_drainer.discard(chat_id, message_ids)
+    if state_store.enabled:
+        state_store.remove_deletions(chat_id, message_ids)
+
+# Function to delete a message unless it has been pinned in the meantime
+async def delete_unless_pinned(chat_id: int, message_id: int) -> bool:
+    # Check if the message is in the pinned messages set before attempting deletion
+    message_key = f"{chat_id}:{message_id}"
+    if message_key in pinned_messages:
+        log_event("pin_deletion_skipped", chat_id=chat_id, message_id=message_id)
         return False
+    
+    async with profiler.track("delete_message"):
+        await bot.delete_message(chat_id=chat_id, message_id=message_id)
+    return True
+
+# Function to leave pinned messages out of a catch-up batch
+def drop_pinned(chat_id: int, message_ids: List[int]) -> List[int]:
+    kept = [message_id for message_id in message_ids if f"{chat_id}:{message_id}" not in pinned_messages]
+    if len(kept) < len(message_ids):
+        metrics.inc("catchup.pinned_skipped", len(message_ids) - len(kept))
+    return kept
+
+# Function to forget catch-up deletions once their batch was sent
+async def finish_catchup_batch(chat_id: int, message_ids: List[int]):
+    if state_store.enabled:
+        state_store.remove_deletions(chat_id, message_ids)
+
+# Overdue deletions (after a restart or rate limiting) are drained oldest first, chat by chat
+catchup_drainer = CatchUpDrainer(bot, api_limiter, keep=drop_pinned, done=finish_catchup_batch)
+
+# Replicas in shared mode claim due deletions from the store
+lease_runner = LeasedDeletionRunner(
+    state_store, delete_unless_pinned, owner=REPLICA_ID, lease_seconds=DELETION_LEASE_SECONDS
+)
 
 # Function to schedule message deletion
 async def schedule_message_deletion(chat_id: int, message_id: int, delay_seconds: int):
+    if DELETION_MODE == "shared":
+        # Whichever replica holds the lease when it is due performs the deletion
+        state_store.add_deletion(chat_id, message_id, time.time() + delay_seconds)
+        return None
+    
+    due_at = time.time() + delay_seconds
+    
     async def delete_message():
         await asyncio.sleep(delay_seconds)
+        handed_over = False
         try:
-            # Check if the message is in the pinned messages set before attempting deletion
-            message_key = f"{chat_id}:{message_id}"
-            if message_key in pinned_messages:
-                print(f"Skipping deletion of pinned message {message_id}")
-                return
-            
-            await bot.delete_message(chat_id=chat_id, message_id=message_id)
-            print(f"Message {message_id} in chat {chat_id} deleted after {delay_seconds}s")
+            if catchup_drainer.active:
+                # Queue behind the older backlog instead of competing with it
+                handed_over = True
+                catchup_drainer.add(chat_id, message_id, due_at)
+            elif await delete_unless_pinned(chat_id, message_id):
+                log_event("message_deleted", chat_id=chat_id, message_id=message_id,
+                          delay=delay_seconds, lag=round(time.time() - due_at, 3))
+        except TelegramRetryAfter as e:
+            # Rate limited: the drainer retries it together with the rest of the backlog
+            handed_over = True
+            catchup_drainer.add(chat_id, message_id, due_at)
+            log_event("deletion_deferred", chat_id=chat_id, message_id=message_id, retry_after=e.retry_after)
         except Exception as e:
-            print(f"Failed to delete message {message_id}: {e}")
+            log_event("message_delete_failed", logging.WARNING, chat_id=chat_id, message_id=message_id,
+                      error=type(e).__name__, detail=str(e))
+        finally:
+            if scheduled_messages.get((chat_id, message_id)) is asyncio.current_task():
+                del scheduled_messages[(chat_id, message_id)]
+            if state_store.enabled and not handed_over:
+                state_store.remove_deletion(chat_id, message_id)
     
     # Cancel any existing scheduled deletion for this message
-    if message_id in scheduled_messages:
-        scheduled_messages[message_id].cancel()
+    if (chat_id, message_id) in scheduled_messages:
+        scheduled_messages[(chat_id, message_id)].cancel()
+    
+    # Record the deletion so it survives a restart
+    if state_store.enabled:
+        state_store.add_deletion(chat_id, message_id, time.time() + delay_seconds)
     
     # Schedule the new deletion task
     task = asyncio.create_task(delete_message())
-    scheduled_messages[message_id] = task
+    scheduled_messages[(chat_id, message_id)] = task
     return task
 
 # Function to format time nicely
@@ -244,6 +517,25 @@ async def safe_edit_message(message, text, reply_markup=None, parse_mode="HTML")
             # Re-raise if it's a different error
             raise
 
+# Function to read a typed time such as "2h35m10s" within the range of the +/- buttons
+def parse_deletion_time(text: str, minimum: int) -> int:
+    seconds = parse_duration(text)
+    if seconds > 86400:
+        raise ValueError("The time can be at most 24 hours.")
+    if seconds < minimum:
+        raise ValueError(f"The time must be at least {minimum} second{'s' if minimum != 1 else ''}.")
+    return seconds
+
+# Function to build the text of the group settings message
+def group_settings_text(chat_id: int) -> str:
+    status = "Enabled" if group_settings.get(chat_id, True) else "Disabled"
+    return (
+        f"🔧 <b>Group Settings</b> 🔧\n\n"
+        f"Message deletion: <b>{status}</b>\n\n"
+        f"Default deletion time: <b>{format_time(default_deletion_times.get(chat_id, 60))}</b>\n\n"
+        "Adjust settings below:"
+    )
+
 # Handler for /start command
 @dp.message(Command("start"))
 async def send_welcome(message: Message):
@@ -268,11 +560,15 @@ async def send_help(message: Message):
         "<b>Commands:</b>\n"
         "/start - Start the bot\n"
         "/help - Show this help message\n"
-        "/settings - Change group settings (owners/moderators only)\n\n"
+        "/settings - Change group settings (owners/moderators only). "
+        "/settings 2h35m10s sets the default deletion time directly\n"
+        "/policy - Set deletion times by message and sender type (owners/moderators only)\n"
+        "/purge - Reply to a message to delete everything from it up to the command, "
+        "or /purge N to delete the last N messages (owners/moderators only)\n\n"
         "<b>Features:</b>\n"
         "• Send any message to make it self-destruct\n"
         "• Choose from various timer options\n"
-        "• Use custom time with + and - buttons\n"
+        "• Use custom time with + and - buttons, or reply to the timer menu with a time like 1h30m\n"
         "• Enable/disable message deletion in groups\n\n"
     )
     
@@ -280,7 +576,7 @@ async def send_help(message: Message):
 
 # Handler for /settings command (for groups)
 @dp.message(Command("settings"))
-async def send_settings(message: Message):
+async def send_settings(message: Message, command: CommandObject):
     if message.chat.type in ["group", "supergroup"]:
         chat_id = message.chat.id
         user_id = message.from_user.id
@@ -290,44 +586,280 @@ async def send_settings(message: Message):
             await message.answer("❌ You don't have permission to change settings.\nOnly group owners and moderators can modify settings.")
             return
         
-        is_enabled = group_settings.get(chat_id, True)  # Default to enabled
-        
-        settings_text = f"🔧 <b>Group Settings</b> 🔧\n\n"
-        status = "Enabled" if is_enabled else "Disabled"
-        settings_text += f"Message deletion: <b>{status}</b>\n\n"
-        
-        # Show current default time
-        default_time = default_deletion_times.get(chat_id, 60)
-        settings_text += f"Default deletion time: <b>{format_time(default_time)}</b>\n\n"
-        settings_text += "Adjust settings below:"
+        # "/settings 2h35m10s" sets the default deletion time right away
+        if command.args:
+            try:
+                default_deletion_times[chat_id] = parse_deletion_time(command.args, 0)
+            except ValueError as e:
+                await message.answer(f"⚠️ {e}\nExample: /settings 2h35m10s")
+                return
+            persist_group_settings(chat_id)
         
-        keyboard = get_group_settings_keyboard(chat_id, is_enabled)
-        await message.answer(settings_text, parse_mode="HTML", reply_markup=keyboard)
+        keyboard = get_group_settings_keyboard(chat_id)
+        await message.answer(group_settings_text(chat_id), parse_mode="HTML", reply_markup=keyboard)
     else:
         await message.answer("⚙️ Settings are only available in groups.")
 
+# Function to delete a range of messages in batches while editing a status message
+async def run_purge(chat_id: int, targets: List[int], skipped: int, status: Message):
+    try:
+        # These messages no longer need a scheduled deletion
+        cancel_pending_deletions(chat_id, targets)
+        
+        async def report_progress(done: int, total: int):
+            if done < total:
+                await api_limiter.acquire(chat_id)
+                await safe_edit_message(status, f"🧹 Purging messages... <b>{done}/{total}</b>")
+        
+        started = time.monotonic()
+        deleted, failed = await delete_messages(bot, chat_id, targets, api_limiter, progress=report_progress)
+        log_event("purge_finished", chat_id=chat_id, requested=len(targets) + skipped, deleted=deleted,
+                  failed=failed, skipped_pinned=skipped, duration=round(time.monotonic() - started, 3))
+        
+        result_text = f"✅ <b>Purge finished</b>\n\nProcessed: <b>{deleted}</b> messages\n"
+        if failed:
+            result_text += f"Could not delete: <b>{failed}</b> (too old or missing rights)\n"
+        if skipped:
+            result_text += f"Skipped pinned: <b>{skipped}</b>\n"
+        await api_limiter.acquire(chat_id)
+        await safe_edit_message(status, result_text)
+    except Exception as e:
+        log_event("purge_failed", logging.ERROR, chat_id=chat_id, error=type(e).__name__, detail=str(e))
+        await safe_edit_message(status, "❌ Purge failed. Make sure I am an admin allowed to delete messages.")
+    finally:
+        if active_purges.get(chat_id) is asyncio.current_task():
+            del active_purges[chat_id]
+    
+    # The status message goes away like every other message in the group
+    if group_settings.get(chat_id, True):
+        await schedule_message_deletion(chat_id, status.message_id, default_deletion_times.get(chat_id, 60))
+
+# Handler for /purge command (for groups)
+@dp.message(Command("purge"))
+async def purge_messages(message: Message, command: CommandObject):
+    if message.chat.type not in ["group", "supergroup"]:
+        await message.answer("🧹 Purge is only available in groups.")
+        return
+    
+    chat_id = message.chat.id
+    if not await check_permission(chat_id, message.from_user.id):
+        await message.answer("❌ You don't have permission to purge messages.\nOnly group owners and moderators can purge messages.")
+        return
+    
+    # Everything from the replied-to message (or the last N messages) up to the command itself
+    if message.reply_to_message is not None:
+        first_id = message.reply_to_message.message_id
+    elif command.args and command.args.strip().isdigit():
+        first_id = max(1, message.message_id - int(command.args.strip()))
+    else:
+        await message.answer(
+            "🧹 Reply to a message with /purge to delete everything from it up to here, "
+            "or send /purge N to delete the last N messages."
+        )
+        return
+    
+    message_ids = list(range(first_id, message.message_id + 1))
+    if len(message_ids) > PURGE_LIMIT + 1:
+        await message.answer(f"⚠️ You can purge at most {PURGE_LIMIT} messages at once.")
+        return
+    
+    running = active_purges.get(chat_id)
+    if running is not None and not running.done():
+        await message.answer("⏳ A purge is already running in this group.")
+        return
+    
+    # Pinned messages are kept
+    targets = [message_id for message_id in message_ids if f"{chat_id}:{message_id}" not in pinned_messages]
+    status = await message.answer(f"🧹 Purging messages... <b>0/{len(targets)}</b>", parse_mode="HTML")
+    # Runs in the background so the chat's update lane is not blocked while pacing
+    active_purges[chat_id] = asyncio.create_task(
+        run_purge(chat_id, targets, len(message_ids) - len(targets), status)
+    )
+
+# Function to describe a policy TTL
+def format_policy_ttl(ttl) -> str:
+    return "keep" if ttl is None else format_time(ttl)
+
+# Handler for /policy command (for groups)
+@dp.message(Command("policy"))
+async def manage_policy(message: Message, command: CommandObject):
+    if message.chat.type not in ["group", "supergroup"]:
+        await message.answer("📋 Deletion policies are only available in groups.")
+        return
+    
+    chat_id = message.chat.id
+    if not await check_permission(chat_id, message.from_user.id):
+        await message.answer("❌ You don't have permission to change settings.\nOnly group owners and moderators can modify settings.")
+        return
+    
+    args = (command.args or "").split()
+    policy = chat_policies.get(chat_id) or ChatPolicy()
+    
+    if len(args) == 1 and args[0] == "reset":
+        chat_policies.pop(chat_id, None)
+        if state_store.enabled:
+            state_store.clear_policy(chat_id)
+        await message.answer("📋 All deletion rules removed. Every message uses the default deletion time again.")
+        return
+    
+    if len(args) == 3:
+        content, sender, value = args[0].lower(), args[1].lower(), args[2].lower()
+        try:
+            ChatPolicy.validate(content, sender)
+            if value == "default":
+                policy.remove_rule(content, sender)
+            else:
+                # Same range as the default deletion time; longer timers would outlive
+                # the 48 hours in which Telegram still lets bots delete a message
+                ttl = None if value == "keep" else parse_deletion_time(value, 0)
+                policy.set_rule(content, sender, ttl)
+        except ValueError as e:
+            await message.answer(f"⚠️ {e}")
+            return
+        
+        if policy.rules:
+            chat_policies[chat_id] = policy
+        else:
+            chat_policies.pop(chat_id, None)
+        if state_store.enabled:
+            if value == "default":
+                state_store.remove_policy_rule(chat_id, content, sender)
+            else:
+                state_store.save_policy_rule(chat_id, content, sender, policy.rules[(content, sender)])
+    elif args:
+        await message.answer(
+            "📋 <b>Usage</b>\n\n"
+            "/policy - show the rules\n"
+            "/policy &lt;content&gt; &lt;sender&gt; &lt;time|keep|default&gt; - set or remove a rule\n"
+            "/policy reset - remove all rules\n\n"
+            f"Content: {', '.join(CONTENT_CLASSES)} or *\n"
+            f"Sender: {', '.join(SENDER_CLASSES)} or *\n"
+            "Time: e.g. 30s, 10m, 2h35m (at most 24h)\n\n"
+            "Example: /policy media * 10m, /policy * admin keep",
+            parse_mode="HTML"
+        )
+        return
+    
+    default_time = default_deletion_times.get(chat_id, 60)
+    policy_text = "📋 <b>Deletion Policy</b> 📋\n\n"
+    if policy.rules:
+        for content, sender, ttl in policy.sorted_rules():
+            content = "any message" if content == ANY else content
+            sender = "anyone" if sender == ANY else sender
+            policy_text += f"{content} from {sender}: <b>{format_policy_ttl(ttl)}</b>\n"
+    else:
+        policy_text += "No rules set.\n"
+    policy_text += f"\nEverything else: <b>{format_time(default_time)}</b> (default deletion time)"
+    await message.answer(policy_text, parse_mode="HTML")
+
+# Handler for changes of the bot's own membership and rights
+@dp.my_chat_member()
+async def handle_my_chat_member(event: types.ChatMemberUpdated):
+    if event.chat.type in ["group", "supergroup"]:
+        update_bot_rights(event.chat.id, event.new_chat_member)
+
+# Handler for durations typed in reply to the group settings or custom timer message
+@dp.message(F.text, F.reply_to_message)
+async def handle_typed_time(message: Message):
+    menu = message.reply_to_message
+    if menu.from_user is None or menu.from_user.id != bot.id or not menu.text:
+        raise SkipHandler()
+    
+    chat_id = message.chat.id
+    if menu.text.startswith("🔧 Group Settings") and message.chat.type in ["group", "supergroup"]:
+        minimum = 0
+    elif menu.text.startswith("⏱️ Custom Timer Settings") and message.chat.type == "private":
+        minimum = 1
+    else:
+        raise SkipHandler()
+    
+    # Anything that is not a duration is handled like any other message
+    try:
+        parse_duration(message.text)
+    except ValueError:
+        raise SkipHandler()
+    if minimum == 0 and not await check_permission(chat_id, message.from_user.id):
+        raise SkipHandler()
+    
+    try:
+        seconds = parse_deletion_time(message.text, minimum)
+    except ValueError as e:
+        await message.answer(f"⚠️ {e}")
+        return
+    
+    # One edit of the menu replaces the +/- button taps
+    if minimum == 0:
+        default_deletion_times[chat_id] = seconds
+        persist_group_settings(chat_id)
+        await safe_edit_message(menu, group_settings_text(chat_id), reply_markup=get_group_settings_keyboard(chat_id))
+        # The reply is a group message like any other, deleted with the new default
+        if group_settings.get(chat_id, True):
+            await schedule_group_message_deletion(message)
+    else:
+        key = f"{message.from_user.id}:{chat_id}"
+        custom_timers[key] = seconds
+        await safe_edit_message(
+            menu,
+            f"⏱️ <b>Custom Timer Settings</b> ⏱️\n\n"
+            f"Current time: <b>{format_time(seconds)}</b>\n\n"
+            f"Use the buttons below to adjust the time:",
+            reply_markup=get_custom_time_keyboard(seconds)
+        )
+
 # Handler for pinned message events
-@dp.message()
+@dp.message(F.pinned_message)
 async def handle_pinned_message_event(message: Message):
     # When a message gets pinned, Telegram sends a service message with the pinned_message attribute
     if message.pinned_message is not None:
         # When a message gets pinned, add it to our tracking set
         pinned_msg = message.pinned_message
         if pinned_msg:
-            message_key = f"{message.chat.id}:{pinned_msg.message_id}"
-            pinned_messages.add(message_key)
-            print(f"Added pinned message to tracking: {message_key}")
-            
-            # Also cancel any scheduled deletion for this message if it exists
-            if pinned_msg.message_id in scheduled_messages:
-                scheduled_messages[pinned_msg.message_id].cancel()
-                del scheduled_messages[pinned_msg.message_id]
-                print(f"Cancelled scheduled deletion for pinned message {pinned_msg.message_id}")
+            track_pinned_message(message.chat.id, pinned_msg.message_id)
 
 # Note: Unfortunately, Telegram doesn't provide a reliable way to detect when a message is unpinned
 # and remove it from our tracking set. The service message sent when unpinning doesn't include
-# the original message ID. As a result, pinned messages will remain in our tracking set 
-# until the bot is restarted. This is a known limitation of this implementation.
+# the original message ID. The reconcile_pinned_messages maintenance job below clears the
+# tracking set of groups that no longer have any pinned message.
+
+# Function to schedule a group message with the group's default time or policy
+async def schedule_group_message_deletion(message: Message):
+    chat_id = message.chat.id
+    
+    # Deleting would fail anyway if the bot lacks the right to
+    if not bot_can_delete(chat_id):
+        metrics.inc("deletions.no_rights")
+        return
+    
+    # If deletion is enabled, use the default time for automatic deletion
+    default_time = default_deletion_times.get(chat_id, 60)  # Default to 60 seconds
+    
+    # Groups with a policy get a TTL by content and sender type
+    policy = chat_policies.get(chat_id)
+    if policy is not None:
+        admin_ids = None
+        if policy.uses_admins:
+            try:
+                admin_ids = await get_chat_admin_ids(chat_id)
+            except Exception:
+                pass
+        delay_seconds = policy.ttl_for(content_class(message), sender_class(message, admin_ids), default_time)
+        if delay_seconds is None:
+            # Exempt by policy
+            return
+    else:
+        delay_seconds = default_time
+    
+    # Check if this message has already been pinned before scheduling deletion
+    message_key = f"{chat_id}:{message.message_id}"
+    if message_key in pinned_messages:
+        log_event("pin_schedule_skipped", chat_id=chat_id, message_id=message.message_id)
+        return
+        
+    await schedule_message_deletion(
+        chat_id=message.chat.id,
+        message_id=message.message_id,
+        delay_seconds=delay_seconds
+    )
 
 # Handler for regular messages
 @dp.message()
@@ -349,20 +881,7 @@ async def handle_message(message: Message):
                 # This is a pin notification, not the actual message to delete
                 return
             
-            # If deletion is enabled, use the default time for automatic deletion
-            default_time = default_deletion_times.get(chat_id, 60)  # Default to 60 seconds
-            
-            # Check if this message has already been pinned before scheduling deletion
-            message_key = f"{chat_id}:{message.message_id}"
-            if message_key in pinned_messages:
-                print(f"Skipping scheduling for pinned message {message.message_id}")
-                return
-                
-            await schedule_message_deletion(
-                chat_id=message.chat.id,
-                message_id=message.message_id,
-                delay_seconds=default_time
-            )
+            await schedule_group_message_deletion(message)
     else:
         # For private chats, show timer options
         await message.answer(
@@ -372,7 +891,7 @@ async def handle_message(message: Message):
 
 # Handler for callback queries
 @dp.callback_query()
-async def handle_callback(callback_query: types.CallbackQuery):
+async def handle_callback(callback_query: types.CallbackQuery, ack: CallbackAck):
     # Check if this is a group callback and requires permission
     if callback_query.message.chat.type in ["group", "supergroup"]:
         chat_id = callback_query.message.chat.id
@@ -386,8 +905,7 @@ async def handle_callback(callback_query: types.CallbackQuery):
             "increase_second_default", "decrease_second_default", "save_changes"
         ]:
             if not await check_permission(chat_id, user_id):
-                await bot.answer_callback_query(
-                    callback_query.id, 
+                await ack.answer(
                     "❌ You don't have permission to change settings.\nOnly group owners and moderators can modify settings.",
                     show_alert=True
                 )
@@ -399,8 +917,7 @@ async def handle_callback(callback_query: types.CallbackQuery):
         
         # Inform user about the selected timer
         formatted_time = format_time(delay_seconds)
-        await bot.answer_callback_query(
-            callback_query.id,
+        await ack.answer(
             f"⏰ Timer set to {formatted_time}! Message will self-destruct after this time."
         )
         
@@ -428,6 +945,7 @@ async def handle_callback(callback_query: types.CallbackQuery):
         if key not in custom_timers:
             custom_timers[key] = 3600  # 1 hour in seconds
         
+        await ack.answer()
         await callback_query.message.edit_text(
             f"⏱️ <b>Custom Timer Settings</b> ⏱️\n\n"
             f"Current time: <b>{format_time(custom_timers[key])}</b>\n\n"
@@ -450,6 +968,7 @@ async def handle_callback(callback_query: types.CallbackQuery):
         if custom_timers[key] > 86400:
             custom_timers[key] = 86400
         
+        await ack.answer(f"Time increased to {format_time(custom_timers[key])}")
         await callback_query.message.edit_text(
             f"⏱️ <b>Custom Timer Settings</b> ⏱️\n\n"
             f"Current time: <b>{format_time(custom_timers[key])}</b>\n\n"
@@ -457,8 +976,6 @@ async def handle_callback(callback_query: types.CallbackQuery):
             parse_mode="HTML",
             reply_markup=get_custom_time_keyboard(custom_timers[key])
         )
-        
-        await callback_query.answer(f"Time increased to {format_time(custom_timers[key])}")
     
     elif callback_query.data == "decrease_hour":
         user_id = callback_query.from_user.id
@@ -473,6 +990,7 @@ async def handle_callback(callback_query: types.CallbackQuery):
         if custom_timers[key] < 60:
             custom_timers[key] = 60
         
+        await ack.answer(f"Time decreased to {format_time(custom_timers[key])}")
         await callback_query.message.edit_text(
             f"⏱️ <b>Custom Timer Settings</b> ⏱️\n\n"
             f"Current time: <b>{format_time(custom_timers[key])}</b>\n\n"
@@ -480,8 +998,6 @@ async def handle_callback(callback_query: types.CallbackQuery):
             parse_mode="HTML",
             reply_markup=get_custom_time_keyboard(custom_timers[key])
         )
-        
-        await callback_query.answer(f"Time decreased to {format_time(custom_timers[key])}")
     
     elif callback_query.data == "increase_minute":
         user_id = callback_query.from_user.id
@@ -497,6 +1013,7 @@ async def handle_callback(callback_query: types.CallbackQuery):
         if custom_timers[key] > 86400:
             custom_timers[key] = 86400
         
+        await ack.answer(f"Time increased to {format_time(custom_timers[key])}")
         await callback_query.message.edit_text(
             f"⏱️ <b>Custom Timer Settings</b> ⏱️\n\n"
             f"Current time: <b>{format_time(custom_timers[key])}</b>\n\n"
@@ -504,8 +1021,6 @@ async def handle_callback(callback_query: types.CallbackQuery):
             parse_mode="HTML",
             reply_markup=get_custom_time_keyboard(custom_timers[key])
         )
-        
-        await callback_query.answer(f"Time increased to {format_time(custom_timers[key])}")
     
     elif callback_query.data == "decrease_minute":
         user_id = callback_query.from_user.id
@@ -520,6 +1035,7 @@ async def handle_callback(callback_query: types.CallbackQuery):
         if custom_timers[key] < 60:
             custom_timers[key] = 60
         
+        await ack.answer(f"Time decreased to {format_time(custom_timers[key])}")
         await callback_query.message.edit_text(
             f"⏱️ <b>Custom Timer Settings</b> ⏱️\n\n"
             f"Current time: <b>{format_time(custom_timers[key])}</b>\n\n"
@@ -527,8 +1043,6 @@ async def handle_callback(callback_query: types.CallbackQuery):
             parse_mode="HTML",
             reply_markup=get_custom_time_keyboard(custom_timers[key])
         )
-        
-        await callback_query.answer(f"Time decreased to {format_time(custom_timers[key])}")
     
     elif callback_query.data == "increase_second":
         user_id = callback_query.from_user.id
@@ -544,6 +1058,7 @@ async def handle_callback(callback_query: types.CallbackQuery):
         if custom_timers[key] > 86400:
             custom_timers[key] = 86400
         
+        await ack.answer(f"Time increased to {format_time(custom_timers[key])}")
         await callback_query.message.edit_text(
             f"⏱️ <b>Custom Timer Settings</b> ⏱️\n\n"
             f"Current time: <b>{format_time(custom_timers[key])}</b>\n\n"
@@ -551,8 +1066,6 @@ async def handle_callback(callback_query: types.CallbackQuery):
             parse_mode="HTML",
             reply_markup=get_custom_time_keyboard(custom_timers[key])
         )
-        
-        await callback_query.answer(f"Time increased to {format_time(custom_timers[key])}")
     
     elif callback_query.data == "decrease_second":
         user_id = callback_query.from_user.id
@@ -567,6 +1080,7 @@ async def handle_callback(callback_query: types.CallbackQuery):
         if custom_timers[key] < 1:
             custom_timers[key] = 1
         
+        await ack.answer(f"Time decreased to {format_time(custom_timers[key])}")
         await callback_query.message.edit_text(
             f"⏱️ <b>Custom Timer Settings</b> ⏱️\n\n"
             f"Current time: <b>{format_time(custom_timers[key])}</b>\n\n"
@@ -574,16 +1088,14 @@ async def handle_callback(callback_query: types.CallbackQuery):
             parse_mode="HTML",
             reply_markup=get_custom_time_keyboard(custom_timers[key])
         )
-        
-        await callback_query.answer(f"Time decreased to {format_time(custom_timers[key])}")
     
     elif callback_query.data == "space_min_custom":
         # This is just a placeholder button with no action
-        await callback_query.answer()
+        await ack.answer()
     
     elif callback_query.data == "space_sec_custom":
         # This is just a placeholder button with no action
-        await callback_query.answer()
+        await ack.answer()
     
     elif callback_query.data.startswith("set_custom_"):
         # Extract custom time from callback data
@@ -591,8 +1103,7 @@ async def handle_callback(callback_query: types.CallbackQuery):
         
         # Inform user about the selected timer
         formatted_time = format_time(delay_seconds)
-        await bot.answer_callback_query(
-            callback_query.id,
+        await ack.answer(
             f"⏰ Custom timer set to {formatted_time}! Message will self-destruct after this time."
         )
         
@@ -611,6 +1122,7 @@ async def handle_callback(callback_query: types.CallbackQuery):
         )
     
     elif callback_query.data == "cancel_custom":
+        await ack.answer()
         await callback_query.message.edit_text(
             "⏱️ <b>Custom Timer Settings</b> ⏱️\n\n"
             "Timer selection cancelled.",
@@ -620,6 +1132,7 @@ async def handle_callback(callback_query: types.CallbackQuery):
     
     elif callback_query.data == "start_settings":
         if callback_query.message.chat.type in ["private"]:
+            await ack.answer()
             await callback_query.message.edit_text(
                 "🔧 <b>Settings Menu</b> 🔧\n\n"
                 "This bot doesn't have personal settings.\n\n"
@@ -635,12 +1148,13 @@ async def handle_callback(callback_query: types.CallbackQuery):
             
             # Check if user has permission
             if not await check_permission(chat_id, user_id):
-                await callback_query.answer(
+                await ack.answer(
                     "❌ You don't have permission to change settings.\nOnly group owners and moderators can modify settings.",
                     show_alert=True
                 )
                 return
             
+            await ack.answer()
             is_enabled = group_settings.get(chat_id, True)  # Default to enabled
             
             settings_text = f"🔧 <b>Group Settings</b> 🔧\n\n"
@@ -658,6 +1172,7 @@ async def handle_callback(callback_query: types.CallbackQuery):
     elif callback_query.data == "enable_delete":
         chat_id = callback_query.message.chat.id
         group_settings[chat_id] = True
+        persist_group_settings(chat_id)
         is_enabled = group_settings.get(chat_id, True)
         
         # Show current default time
@@ -668,7 +1183,7 @@ async def handle_callback(callback_query: types.CallbackQuery):
         settings_text += f"Default deletion time: <b>{format_time(default_time)}</b>\n\n"
         settings_text += "Adjust settings below:"
         
-        await bot.answer_callback_query(callback_query.id, "✅ Message deletion enabled in this group!")
+        await ack.answer("✅ Message deletion enabled in this group!")
         await safe_edit_message(
             callback_query.message,
             settings_text,
@@ -678,6 +1193,7 @@ async def handle_callback(callback_query: types.CallbackQuery):
     elif callback_query.data == "disable_delete":
         chat_id = callback_query.message.chat.id
         group_settings[chat_id] = False
+        persist_group_settings(chat_id)
         is_enabled = group_settings.get(chat_id, True)
         
         # Show current default time
@@ -688,7 +1204,7 @@ async def handle_callback(callback_query: types.CallbackQuery):
         settings_text += f"Default deletion time: <b>{format_time(default_time)}</b>\n\n"
         settings_text += "Adjust settings below:"
         
-        await bot.answer_callback_query(callback_query.id, "❌ Message deletion disabled in this group!")
+        await ack.answer("❌ Message deletion disabled in this group!")
         await safe_edit_message(
             callback_query.message,
             settings_text,
@@ -700,6 +1216,7 @@ async def handle_callback(callback_query: types.CallbackQuery):
         # Extract time from callback data
         time_seconds = int(callback_query.data.split("_")[1])
         default_deletion_times[chat_id] = time_seconds
+        persist_group_settings(chat_id)
         is_enabled = group_settings.get(chat_id, True)
         
         settings_text = f"🔧 <b>Group Settings</b> 🔧\n\n"
@@ -708,12 +1225,12 @@ async def handle_callback(callback_query: types.CallbackQuery):
         settings_text += f"Default deletion time: <b>{format_time(time_seconds)}</b>\n\n"
         settings_text += "Adjust settings below:"
         
+        await ack.answer(f"Default time set to {format_time(time_seconds)}")
         await safe_edit_message(
             callback_query.message,
             settings_text,
             reply_markup=get_group_settings_keyboard(chat_id, is_enabled)
         )
-        await bot.answer_callback_query(callback_query.id, f"Default time set to {format_time(time_seconds)}")
     
     elif callback_query.data == "increase_hour_default":
         chat_id = callback_query.message.chat.id
@@ -727,6 +1244,7 @@ async def handle_callback(callback_query: types.CallbackQuery):
             new_time = 86400
             
         default_deletion_times[chat_id] = new_time
+        persist_group_settings(chat_id)
         is_enabled = group_settings.get(chat_id, True)
         
         settings_text = f"🔧 <b>Group Settings</b> 🔧\n\n"
@@ -735,12 +1253,12 @@ async def handle_callback(callback_query: types.CallbackQuery):
         settings_text += f"Default deletion time: <b>{format_time(new_time)}</b>\n\n"
         settings_text += "Adjust settings below:"
         
+        await ack.answer(f"Default time increased to {format_time(new_time)}")
         await safe_edit_message(
             callback_query.message,
             settings_text,
             reply_markup=get_group_settings_keyboard(chat_id, is_enabled)
         )
-        await callback_query.answer(f"Default time increased to {format_time(new_time)}")
     
     elif callback_query.data == "decrease_hour_default":
         chat_id = callback_query.message.chat.id
@@ -753,6 +1271,7 @@ async def handle_callback(callback_query: types.CallbackQuery):
             new_time = 0
             
         default_deletion_times[chat_id] = new_time
+        persist_group_settings(chat_id)
         is_enabled = group_settings.get(chat_id, True)
         
         settings_text = f"🔧 <b>Group Settings</b> 🔧\n\n"
@@ -761,12 +1280,12 @@ async def handle_callback(callback_query: types.CallbackQuery):
         settings_text += f"Default deletion time: <b>{format_time(new_time)}</b>\n\n"
         settings_text += "Adjust settings below:"
         
+        await ack.answer(f"Default time decreased to {format_time(new_time)}")
         await safe_edit_message(
             callback_query.message,
             settings_text,
             reply_markup=get_group_settings_keyboard(chat_id, is_enabled)
         )
-        await callback_query.answer(f"Default time decreased to {format_time(new_time)}")
     
     elif callback_query.data == "increase_minute_default":
         chat_id = callback_query.message.chat.id
@@ -791,6 +1310,7 @@ async def handle_callback(callback_query: types.CallbackQuery):
         # Calculate new total seconds
         new_time = hours * 3600 + minutes * 60 + seconds
         default_deletion_times[chat_id] = new_time
+        persist_group_settings(chat_id)
         is_enabled = group_settings.get(chat_id, True)
         
         settings_text = f"🔧 <b>Group Settings</b> 🔧\n\n"
@@ -799,12 +1319,12 @@ async def handle_callback(callback_query: types.CallbackQuery):
         settings_text += f"Default deletion time: <b>{format_time(new_time)}</b>\n\n"
         settings_text += "Adjust settings below:"
         
+        await ack.answer(f"Default time increased to {format_time(new_time)}")
         await safe_edit_message(
             callback_query.message,
             settings_text,
             reply_markup=get_group_settings_keyboard(chat_id, is_enabled)
         )
-        await callback_query.answer(f"Default time increased to {format_time(new_time)}")
     
     elif callback_query.data == "decrease_minute_default":
         chat_id = callback_query.message.chat.id
@@ -833,6 +1353,7 @@ async def handle_callback(callback_query: types.CallbackQuery):
             new_time = 60  # Minimum time of 1 minute
             
         default_deletion_times[chat_id] = new_time
+        persist_group_settings(chat_id)
         is_enabled = group_settings.get(chat_id, True)
         
         settings_text = f"🔧 <b>Group Settings</b> 🔧\n\n"
@@ -841,12 +1362,12 @@ async def handle_callback(callback_query: types.CallbackQuery):
         settings_text += f"Default deletion time: <b>{format_time(new_time)}</b>\n\n"
         settings_text += "Adjust settings below:"
         
+        await ack.answer(f"Default time decreased to {format_time(new_time)}")
         await safe_edit_message(
             callback_query.message,
             settings_text,
             reply_markup=get_group_settings_keyboard(chat_id, is_enabled)
         )
-        await callback_query.answer(f"Default time decreased to {format_time(new_time)}")
     
     elif callback_query.data == "increase_second_default":
         chat_id = callback_query.message.chat.id
@@ -874,6 +1395,7 @@ async def handle_callback(callback_query: types.CallbackQuery):
         # Calculate new total seconds
         new_time = hours * 3600 + minutes * 60 + seconds
         default_deletion_times[chat_id] = new_time
+        persist_group_settings(chat_id)
         is_enabled = group_settings.get(chat_id, True)
         
         settings_text = f"🔧 <b>Group Settings</b> 🔧\n\n"
@@ -882,12 +1404,12 @@ async def handle_callback(callback_query: types.CallbackQuery):
         settings_text += f"Default deletion time: <b>{format_time(new_time)}</b>\n\n"
         settings_text += "Adjust settings below:"
         
+        await ack.answer(f"Default time increased to {format_time(new_time)}")
         await safe_edit_message(
             callback_query.message,
             settings_text,
             reply_markup=get_group_settings_keyboard(chat_id, is_enabled)
         )
-        await callback_query.answer(f"Default time increased to {format_time(new_time)}")
     
     elif callback_query.data == "decrease_second_default":
         chat_id = callback_query.message.chat.id
@@ -920,6 +1442,7 @@ async def handle_callback(callback_query: types.CallbackQuery):
             new_time = 60  # Minimum time of 1 minute
             
         default_deletion_times[chat_id] = new_time
+        persist_group_settings(chat_id)
         is_enabled = group_settings.get(chat_id, True)
         
         settings_text = f"🔧 <b>Group Settings</b> 🔧\n\n"
@@ -928,31 +1451,33 @@ async def handle_callback(callback_query: types.CallbackQuery):
         settings_text += f"Default deletion time: <b>{format_time(new_time)}</b>\n\n"
         settings_text += "Adjust settings below:"
         
+        await ack.answer(f"Default time decreased to {format_time(new_time)}")
         await safe_edit_message(
             callback_query.message,
             settings_text,
             reply_markup=get_group_settings_keyboard(chat_id, is_enabled)
         )
-        await callback_query.answer(f"Default time decreased to {format_time(new_time)}")
     
     elif callback_query.data == "space_min":
         # This is just a placeholder button with no action
-        await callback_query.answer()
+        await ack.answer()
     
     elif callback_query.data == "space_sec":
         # This is just a placeholder button with no action
-        await callback_query.answer()
+        await ack.answer()
     
     elif callback_query.data == "show_default_time":
         chat_id = callback_query.message.chat.id
         current_time = default_deletion_times.get(chat_id, 60)
-        await callback_query.answer(f"Current default time: {format_time(current_time)}")
+        await ack.answer(f"Current default time: {format_time(current_time)}")
     
     elif callback_query.data == "save_changes":
         chat_id = callback_query.message.chat.id
         is_enabled = group_settings.get(chat_id, True)
         default_time = default_deletion_times.get(chat_id, 60)
         
+        persist_group_settings(chat_id)
+        
         # Send confirmation message
         confirmation_text = (
             f"✅ <b>Settings Saved Successfully!</b> ✅\n\n"
@@ -961,8 +1486,8 @@ async def handle_callback(callback_query: types.CallbackQuery):
             f"All changes have been applied to this group."
         )
         
+        await ack.answer("Settings saved successfully!")
         await callback_query.message.edit_text(confirmation_text, parse_mode="HTML")
-        await bot.answer_callback_query(callback_query.id, "Settings saved successfully!")
     
     elif callback_query.data == "show_time":
         # Just show the current time without changing anything
@@ -971,29 +1496,178 @@ async def handle_callback(callback_query: types.CallbackQuery):
         key = f"{user_id}:{chat_id}"
         
         if key in custom_timers:
-            await callback_query.answer(f"Current time: {format_time(custom_timers[key])}")
+            await ack.answer(f"Current time: {format_time(custom_timers[key])}")
+        else:
+            await ack.answer("Current time: 1 hour")
+
+# Placeholder buttons that only show information, safe to drop under load
+COSMETIC_CALLBACKS = {
+    "space_min", "space_sec", "space_min_custom", "space_sec_custom",
+    "show_time", "show_default_time"
+}
+
+# Updates that may be shed when their lane is full
+def is_cosmetic_update(update: types.Update) -> bool:
+    return update.callback_query is not None and update.callback_query.data in COSMETIC_CALLBACKS
+
+# Handler timings are only recorded while a profiling session is running
+dp.message.middleware(HandlerTimingMiddleware(profiler))
+dp.callback_query.middleware(HandlerTimingMiddleware(profiler))
+# Every callback query is answered exactly once, by the handler or by this fallback
+dp.callback_query.middleware(CallbackAckMiddleware())
+
+# Redelivered updates are dropped before they reach a lane
+# The recorder sees updates exactly as they arrive, duplicates included
+update_recorder = UpdateRecorder(RECORD_UPDATES) if RECORD_UPDATES else None
+if update_recorder is not None:
+    dp.update.outer_middleware(update_recorder)
+dp.update.outer_middleware(DedupeMiddleware(UPDATE_DEDUPE_WINDOW))
+dp.update.outer_middleware(LaneMiddleware(update_lanes, router=dp, is_cosmetic=is_cosmetic_update))
+
+# Maintenance job: compare tracked pins with the pinned message Telegram reports.
+# Each run checks the next PIN_RECONCILE_BATCH groups under the rate limiter.
+async def reconcile_pinned_messages():
+    global pin_reconcile_cursor
+    tracked: Dict[int, Set[str]] = {}
+    for message_key in list(pinned_messages):
+        tracked.setdefault(int(message_key.split(":")[0]), set()).add(message_key)
+    
+    chat_ids = sorted(set(tracked) | {chat_id for chat_id in group_settings if chat_id < 0})
+    if pin_reconcile_cursor is not None:
+        # Continue after the last checked group, wrapping around to the start
+        start = next((index for index, chat_id in enumerate(chat_ids) if chat_id > pin_reconcile_cursor), 0)
+        chat_ids = chat_ids[start:] + chat_ids[:start]
+    
+    for chat_id in chat_ids[:max(1, PIN_RECONCILE_BATCH)]:
+        pin_reconcile_cursor = chat_id
+        await api_limiter.acquire(chat_id)
+        try:
+            chat = await bot.get_chat(chat_id=chat_id)
+        except Exception as e:
+            log_event("pin_reconcile_failed", logging.WARNING, chat_id=chat_id,
+                      error=type(e).__name__, detail=str(e))
+            continue
+        if chat.pinned_message is None:
+            # Nothing is pinned any more, so none of the tracked pins are still pinned
+            pinned_messages.difference_update(tracked.get(chat_id, set()))
+        elif f"{chat_id}:{chat.pinned_message.message_id}" not in pinned_messages:
+            # Pinned while the bot was offline
+            track_pinned_message(chat_id, chat.pinned_message.message_id)
+    metrics.set_gauge("pinned_messages", len(pinned_messages))
+
+# Maintenance job: drop expired admin lists and idle rate limit buckets
+async def sweep_caches():
+    now = clock()
+    expired = [chat_id for chat_id, (fetched_at, _) in admin_cache.items() if now - fetched_at >= ADMIN_CACHE_TTL]
+    for chat_id in expired:
+        del admin_cache[chat_id]
+    api_limiter.sweep()
+    metrics.inc("admin_cache.expired", len(expired))
+    metrics.set_gauge("admin_cache.size", len(admin_cache))
+    metrics.set_gauge("bot_rights.size", len(bot_rights))
+
+# Maintenance job: write all group settings to the store off the event loop
+async def write_snapshot():
+    await asyncio.get_running_loop().run_in_executor(None, snapshot_settings)
+
+# Maintenance job: log the metrics of the last window
+async def rollup_metrics():
+    metrics.set_gauge("scheduled_messages", len(scheduled_messages))
+    # Lookups served from cache since startup; warm-up fetches are not counted as misses
+    for cache in ("admin_cache", "bot_rights"):
+        hits = metrics.counters.get(f"{cache}.hits", 0)
+        lookups = hits + metrics.counters.get(f"{cache}.misses", 0)
+        if lookups:
+            metrics.set_gauge(f"{cache}.hit_rate", round(hits / lookups, 4))
+    log_event("metrics", **metrics.rollup())
+
+maintenance.add("reconcile_pinned_messages", PIN_RECONCILE_INTERVAL, reconcile_pinned_messages)
+maintenance.add("sweep_caches", CACHE_SWEEP_INTERVAL, sweep_caches)
+if state_store.enabled:
+    maintenance.add("write_snapshot", SNAPSHOT_INTERVAL, write_snapshot)
+maintenance.add("rollup_metrics", METRICS_ROLLUP_INTERVAL, rollup_metrics)
+
+# Load persisted state and start the update lanes together with polling
+@dp.startup()
+async def on_startup(shard_index: int = 0, shard_count: int = 1):
+    global prewarm_task
+    if state_store.enabled:
+        # Store writes from handlers are committed by a background thread from now on
+        state_store.start_writer()
+        # Worker processes only load the chats they own
+        for chat_id, (enabled, default_time) in state_store.load_settings(shard_index, shard_count).items():
+            group_settings[chat_id] = enabled
+            default_deletion_times[chat_id] = default_time
+        for chat_id, rules in state_store.load_policies(shard_index, shard_count).items():
+            chat_policies[chat_id] = ChatPolicy(rules)
+        
+        if DELETION_MODE == "shared":
+            lease_runner.start()
         else:
-            await callback_query.answer("Current time: 1 hour")
+            # Re-schedule deletions that were pending before the restart; the ones
+            # that came due while the bot was down go to the catch-up drainer, oldest first
+            now = time.time()
+            for chat_id, message_id, due_at in state_store.load_deletions(shard_index, shard_count):
+                if due_at <= now:
+                    catchup_drainer.add(chat_id, message_id, due_at)
+                else:
+                    await schedule_message_deletion(chat_id, message_id, int(due_at - now))
     
-    # Acknowledge the callback
-    await callback_query.answer()
+    if update_recorder is not None:
+        update_recorder.start(f".{shard_index}" if shard_count > 1 else "")
+    update_lanes.start()
+    maintenance.start()
+    if DELETION_MODE != "shared":
+        catchup_drainer.start()
+    profiler.install_signal_handlers(PROFILE_SECONDS)
+    
+    # Fill the admin and bot rights caches of known groups while polling starts
+    known_chats = {chat_id for chat_id in set(group_settings) | set(chat_policies) if chat_id < 0}
+    if PREWARM_CONCURRENCY > 0 and known_chats:
+        prewarm_task = asyncio.create_task(prewarm(
+            known_chats,
+            {"admin_cache": fetch_chat_admin_ids, "bot_rights": fetch_bot_rights},
+            api_limiter,
+            concurrency=PREWARM_CONCURRENCY
+        ))
 
-import traceback
+# Finish queued updates and save settings before the bot shuts down
+@dp.shutdown()
+async def on_shutdown():
+    if prewarm_task is not None:
+        prewarm_task.cancel()
+    await update_lanes.stop()
+    await maintenance.stop()
+    await lease_runner.stop()
+    await catchup_drainer.stop()
+    for task in list(active_purges.values()):
+        task.cancel()
+    profiler.stop()
+    if update_recorder is not None:
+        update_recorder.stop()
+    if state_store.enabled:
+        snapshot_settings()
+        state_store.close()
 
-# Run scheduler
-async def run_scheduler():
-    while True:
-        await schedule.run_pending()
-        await asyncio.sleep(1)
+import traceback
 
 if __name__ == "__main__":
     print("Starting Message Self-Destructor Bot...")
     print("Bot is running...")
     
+    if WORKER_PROCESSES > 1:
+        # Sharded mode: this process only receives updates and routes them by chat
+        from sharding import run_sharded
+        webhook = (WEBHOOK_URL, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH) if WEBHOOK_URL else None
+        print(f"Running with {WORKER_PROCESSES} worker processes")
+        run_sharded(dp, bot, WORKER_PROCESSES, WORKER_QUEUE_SIZE, webhook=webhook)
+        sys.exit(0)
+    
     # Run the bot
     try:
         # Attempt to run polling with better error handling
-        dp.run_polling(bot, skip_updates=True)
+        # Updates are awaited one by one so that full lanes slow down polling
+        dp.run_polling(bot, skip_updates=True, handle_as_tasks=False)
     except KeyboardInterrupt:
         print("Bot stopped by user")
     except Exception as e:
@@ -0,0 +1,120 @@
+# Event-driven scheduler for recurring maintenance jobs
+#
+# Jobs are kept in a heap ordered by their next deadline and the scheduler
+# sleeps until the earliest one instead of waking up every second. Each run
+# gets some jitter so jobs do not line up, a job never overlaps with its own
+# previous run, and run time, skips and failures go to the metrics registry.
+# Deadlines use the event loop's clock, so a replay with scaled virtual time
+# (see replay.py) speeds the jobs up as well.
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import metrics
+
+JobFunc = Callable[[], Awaitable[object]]
+
+
+def _now() -> float:
+    return asyncio.get_running_loop().time()
+
+
+class MaintenanceJob:
+    def __init__(self, name: str, interval: float, func: JobFunc, jitter: float = 0.1):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        # Fraction of the interval by which each run may move earlier or later
+        self.jitter = jitter
+        self.task: Optional[asyncio.Task] = None
+
+    def next_delay(self) -> float:
+        return self.interval * (1 + random.uniform(-self.jitter, self.jitter))
+
+
+class MaintenanceScheduler:
+    def __init__(self):
+        self.jobs: Dict[str, MaintenanceJob] = {}
+        self._heap: List[Tuple[float, int, MaintenanceJob]] = []
+        self._sequence = itertools.count()
+        self._changed: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def add(self, name: str, interval: float, func: JobFunc, jitter: float = 0.1):
+        job = MaintenanceJob(name, interval, func, jitter)
+        self.jobs[name] = job
+        if self._task is not None:
+            self._push(job, _now() + job.next_delay())
+            self._changed.set()
+
+    def start(self):
+        if self._task is not None:
+            return
+        self._changed = asyncio.Event()
+        now = _now()
+        for job in self.jobs.values():
+            self._push(job, now + job.next_delay())
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        running = [job.task for job in self.jobs.values() if job.task is not None]
+        for task in running:
+            task.cancel()
+        await asyncio.gather(self._task, *running, return_exceptions=True)
+        self._task = None
+        self._heap.clear()
+
+    def _push(self, job: MaintenanceJob, deadline: float):
+        heapq.heappush(self._heap, (deadline, next(self._sequence), job))
+
+    async def _run(self):
+        while True:
+            if not self._heap:
+                await self._changed.wait()
+                self._changed.clear()
+                continue
+
+            deadline, _, job = self._heap[0]
+            delay = deadline - _now()
+            if delay > 0:
+                # Sleep until the deadline, or until a job with an earlier one is added
+                try:
+                    await asyncio.wait_for(self._changed.wait(), timeout=delay)
+                    self._changed.clear()
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(self._heap)
+            if job.task is not None and not job.task.done():
+                # The previous run is still going, skip this one
+                metrics.inc(f"maintenance.{job.name}.skipped")
+            else:
+                job.task = asyncio.create_task(self._execute(job))
+
+            # Keep the cadence, unless the loop fell so far behind that it would run again at once
+            next_deadline = deadline + job.next_delay()
+            now = _now()
+            if next_deadline < now:
+                next_deadline = now + job.next_delay()
+            self._push(job, next_deadline)
+
+    async def _execute(self, job: MaintenanceJob):
+        started = time.perf_counter()
+        try:
+            await job.func()
+            metrics.inc(f"maintenance.{job.name}.runs")
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            metrics.inc(f"maintenance.{job.name}.failures")
+            logging.exception("Maintenance job %s failed", job.name)
+        finally:
+            metrics.observe(f"maintenance.{job.name}", time.perf_counter() - started)
@@ -0,0 +1,57 @@
+# Lightweight in-process metrics registry shared by the bot's subsystems
+from typing import Dict, List
+
+# Monotonic counters (e.g. updates processed, updates shed)
+counters: Dict[str, int] = {}
+# Point-in-time values (e.g. current queue depth)
+gauges: Dict[str, float] = {}
+# Timing aggregates: name -> [count, total_seconds, max_seconds]
+timings: Dict[str, List[float]] = {}
+
+# Increase a counter
+def inc(name: str, value: int = 1):
+    counters[name] = counters.get(name, 0) + value
+
+# Set a gauge to the given value
+def set_gauge(name: str, value: float):
+    gauges[name] = value
+
+# Record a duration (in seconds) under the given name
+def observe(name: str, seconds: float):
+    entry = timings.get(name)
+    if entry is None:
+        timings[name] = [1, seconds, seconds]
+        return
+    entry[0] += 1
+    entry[1] += seconds
+    if seconds > entry[2]:
+        entry[2] = seconds
+
+# Return a plain-dict copy of every metric, suitable for logging
+def snapshot() -> Dict[str, Dict]:
+    return {
+        "counters": dict(counters),
+        "gauges": dict(gauges),
+        "timings": {
+            name: {
+                "count": int(count),
+                "avg_ms": round(total / count * 1000, 3) if count else 0.0,
+                "max_ms": round(peak * 1000, 3),
+            }
+            for name, (count, total, peak) in timings.items()
+        },
+    }
+
+# Return a snapshot and start a new timing window; counters stay cumulative.
+# Timings of a running profiling session ("profile." prefix) are kept.
+def rollup() -> Dict[str, Dict]:
+    current = snapshot()
+    for name in [name for name in timings if not name.startswith("profile.")]:
+        del timings[name]
+    return current
+
+# Clear every metric (used by benchmarks between runs)
+def reset():
+    counters.clear()
+    gauges.clear()
+    timings.clear()
@@ -0,0 +1,115 @@
+# Per-chat deletion policies
+#
+# Admins write rules like "media * 10m" or "* admin keep". A rule matches a
+# content class (or * for any) and a sender class (or * for any) and gives a
+# TTL in seconds, or None to keep the message. Whenever the rules change they
+# are compiled into a flat table with one entry per (content, sender) pair, so
+# classifying a message costs two small lookups instead of walking the rules.
+#
+# Precedence, most specific first: (content, sender), (*, sender),
+# (content, *), (*, *). A sender rule beats a content rule, so "* admin keep"
+# exempts admins even when "media * 10m" exists. Pairs no rule covers use the
+# chat's default deletion time.
+from typing import Dict, FrozenSet, Iterable, Optional, Tuple
+
+from aiogram.types import Message
+
+ANY = "*"
+
+CONTENT_CLASSES = ("text", "command", "media", "service", "other")
+SENDER_CLASSES = ("member", "admin", "bot", "channel")
+
+# Message fields that decide the content class (text is checked first)
+_FIELD_CLASSES: Dict[str, str] = {
+    **dict.fromkeys(
+        ("photo", "video", "animation", "audio", "document", "voice", "video_note", "sticker"),
+        "media"
+    ),
+    **dict.fromkeys(
+        ("new_chat_members", "left_chat_member", "new_chat_title", "new_chat_photo", "delete_chat_photo",
+         "group_chat_created", "supergroup_chat_created", "migrate_to_chat_id", "migrate_from_chat_id",
+         "pinned_message", "message_auto_delete_timer_changed", "forum_topic_created", "forum_topic_edited",
+         "forum_topic_closed", "forum_topic_reopened", "general_forum_topic_hidden",
+         "general_forum_topic_unhidden", "video_chat_scheduled", "video_chat_started", "video_chat_ended",
+         "video_chat_participants_invited", "write_access_allowed", "proximity_alert_triggered"),
+        "service"
+    ),
+}
+
+Rule = Tuple[str, str]
+
+
+# Only looks at the fields present in the update instead of testing every
+# possible attribute like Message.content_type does
+def content_class(message: Message) -> str:
+    text = message.text
+    if text is not None:
+        entities = message.entities
+        if text[:1] == "/" and entities and entities[0].type == "bot_command" and entities[0].offset == 0:
+            return "command"
+        return "text"
+    for field in message.__fields_set__:
+        content = _FIELD_CLASSES.get(field)
+        if content is not None:
+            return content
+    return "other"
+
+
+def sender_class(message: Message, admin_ids: Optional[FrozenSet[int]] = None) -> str:
+    sender_chat = message.sender_chat
+    if sender_chat is not None:
+        # Anonymous admins post as the group itself
+        return "admin" if sender_chat.id == message.chat.id else "channel"
+    user = message.from_user
+    if user is None:
+        return "member"
+    if user.is_bot:
+        return "bot"
+    if admin_ids is not None and user.id in admin_ids:
+        return "admin"
+    return "member"
+
+
+class ChatPolicy:
+    def __init__(self, rules: Optional[Dict[Rule, Optional[int]]] = None):
+        # (content, sender) -> TTL in seconds, or None to keep the message
+        self.rules: Dict[Rule, Optional[int]] = dict(rules or {})
+        self.table: Dict[Rule, Optional[int]] = {}
+        # Admin ids are only needed if some rule targets admins
+        self.uses_admins = False
+        self.compile()
+
+    @staticmethod
+    def validate(content: str, sender: str):
+        if content != ANY and content not in CONTENT_CLASSES:
+            raise ValueError(f"unknown content class: {content}")
+        if sender != ANY and sender not in SENDER_CLASSES:
+            raise ValueError(f"unknown sender class: {sender}")
+
+    def set_rule(self, content: str, sender: str, ttl: Optional[int]):
+        self.validate(content, sender)
+        self.rules[(content, sender)] = ttl
+        self.compile()
+
+    def remove_rule(self, content: str, sender: str) -> bool:
+        removed = self.rules.pop((content, sender), ...) is not ...
+        self.compile()
+        return removed
+
+    def compile(self):
+        table: Dict[Rule, Optional[int]] = {}
+        for content in CONTENT_CLASSES:
+            for sender in SENDER_CLASSES:
+                for key in ((content, sender), (ANY, sender), (content, ANY), (ANY, ANY)):
+                    if key in self.rules:
+                        table[(content, sender)] = self.rules[key]
+                        break
+        self.table = table
+        self.uses_admins = any(sender == "admin" for _, sender in self.rules)
+
+    # TTL for a classified message; `default` when no rule covers it
+    def ttl_for(self, content: str, sender: str, default: int) -> Optional[int]:
+        return self.table.get((content, sender), default)
+
+    def sorted_rules(self) -> Iterable[Tuple[str, str, Optional[int]]]:
+        return sorted((content, sender, ttl) for (content, sender), ttl in self.rules.items())
@@ -0,0 +1,48 @@
+# Startup cache warm-up
+#
+# After a restart every cache is empty, so the first settings tap or message
+# in each group would wait for an API call. The warm-up runs the given fetch
+# functions for every known chat with bounded concurrency, taking a rate
+# limiter token before each call, while polling already runs.
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, Iterable, List
+
+import metrics
+from event_log import log_event
+from ratelimit import RateLimiter
+
+ChatFetch = Callable[[int], Awaitable[object]]
+
+
+async def prewarm(chat_ids: Iterable[int], fetches: Dict[str, ChatFetch], limiter: RateLimiter,
+                  concurrency: int = 8) -> Dict[str, int]:
+    chats: List[int] = list(chat_ids)
+    pending = iter(chats)
+    warmed = {name: 0 for name in fetches}
+    failed = {name: 0 for name in fetches}
+    started = time.monotonic()
+
+    async def worker():
+        for chat_id in pending:
+            for name, fetch in fetches.items():
+                await limiter.acquire(chat_id)
+                try:
+                    await fetch(chat_id)
+                    warmed[name] += 1
+                except Exception as e:
+                    # The bot may have been removed from the chat; it is fetched lazily later
+                    failed[name] += 1
+                    log_event("prewarm_failed", chat_id=chat_id, cache=name, error=type(e).__name__)
+
+    await asyncio.gather(*(worker() for _ in range(max(1, min(concurrency, len(chats))))))
+
+    duration = time.monotonic() - started
+    metrics.set_gauge("prewarm.duration", round(duration, 3))
+    for name in fetches:
+        metrics.inc(f"prewarm.{name}.warmed", warmed[name])
+        metrics.inc(f"prewarm.{name}.failed", failed[name])
+    report = {"chats": len(chats), **{f"{name}_warmed": warmed[name] for name in fetches},
+              **{f"{name}_failed": failed[name] for name in fetches}}
+    log_event("prewarm_finished", duration=round(duration, 3), **report)
+    return report
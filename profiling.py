@@ -0,0 +1,218 @@
+# Runtime-toggleable profiling and memory tracing
+#
+# Everything here is off by default; the handler middleware then only checks a
+# flag. A profiling session is started locally by sending a signal to the bot
+# process and stops on its own after a set duration:
+#   kill -USR1 <pid>   per-handler wall/CPU timing plus a sampling profiler
+#   kill -USR2 <pid>   the same plus tracemalloc allocation growth
+# The report is logged and written to the profile output directory.
+import asyncio
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from aiogram.dispatcher.middlewares.base import BaseMiddleware
+from aiogram.types import TelegramObject
+
+import metrics
+
+# Background thread sampling the stack of one thread at a fixed interval
+class StackSampler(threading.Thread):
+    def __init__(self, thread_id: int, interval: float):
+        super().__init__(name="stack-sampler", daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack: List[str] = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            stack.reverse()
+            self.stacks[tuple(stack)] += 1
+            self.samples += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    # Functions ranked by samples in which they were on top of the stack
+    def top_functions(self, limit: int) -> List[Tuple[str, int]]:
+        leaves: Counter = Counter()
+        for stack, count in self.stacks.items():
+            if stack:
+                leaves[stack[-1]] += count
+        return leaves.most_common(limit)
+
+    # Stacks in the "collapsed" format understood by flamegraph tools
+    def collapsed(self) -> List[str]:
+        return [f"{';'.join(stack)} {count}" for stack, count in self.stacks.most_common()]
+
+
+class Profiler:
+    def __init__(self, output_dir: str = "profiles", sample_interval: float = 0.005, top: int = 20):
+        self.output_dir = output_dir
+        self.sample_interval = sample_interval
+        self.top = top
+        # Checked on the hot path; everything else only runs while True
+        self.active = False
+        self._memory = False
+        self._sampler: Optional[StackSampler] = None
+        self._memory_before: Optional[tracemalloc.Snapshot] = None
+        self._stop_handle: Optional[asyncio.TimerHandle] = None
+        self._started_at = 0.0
+        self._watched: Dict[str, Callable[[], int]] = {}
+        self._sizes_before: Dict[str, int] = {}
+
+    # Report the size of a container (e.g. scheduled_messages) in every session
+    def watch(self, name: str, size: Callable[[], int]):
+        self._watched[name] = size
+
+    def install_signal_handlers(self, duration: float):
+        loop = asyncio.get_running_loop()
+        try:
+            loop.add_signal_handler(signal.SIGUSR1, self.start, duration, False)
+            loop.add_signal_handler(signal.SIGUSR2, self.start, duration, True)
+        except (NotImplementedError, AttributeError):
+            # No SIGUSR1/SIGUSR2 (e.g. on Windows)
+            logging.warning("Profiling signals are not supported on this platform")
+
+    # Start a profiling session that stops itself after `duration` seconds
+    def start(self, duration: float, memory: bool = False):
+        if self.active:
+            logging.info("Profiling session already running")
+            return
+        self.active = True
+        self._memory = memory
+        self._started_at = time.perf_counter()
+        self._sizes_before = {name: size() for name, size in self._watched.items()}
+        # Timings of an earlier session must not leak into this report
+        for name in [name for name in metrics.timings if name.startswith("profile.")]:
+            del metrics.timings[name]
+        if memory:
+            tracemalloc.start(5)
+            self._memory_before = tracemalloc.take_snapshot()
+        self._sampler = StackSampler(threading.get_ident(), self.sample_interval)
+        self._sampler.start()
+        self._stop_handle = asyncio.get_running_loop().call_later(duration, self.stop)
+        logging.info("Profiling for %.0fs (memory tracing %s)", duration, "on" if memory else "off")
+
+    def stop(self):
+        if not self.active:
+            return
+        self.active = False
+        if self._stop_handle is not None:
+            self._stop_handle.cancel()
+            self._stop_handle = None
+        self._sampler.stop()
+        report = self._report()
+        if self._memory:
+            tracemalloc.stop()
+            self._memory_before = None
+        self._write(report)
+
+    # Async context manager timing a block (e.g. one deletion) while profiling
+    def track(self, name: str) -> "_Track":
+        return _Track(self, name)
+
+    def _report(self) -> List[str]:
+        elapsed = time.perf_counter() - self._started_at
+        lines = [f"Profiling session of {elapsed:.1f}s, {self._sampler.samples} stack samples", ""]
+
+        lines.append("Handler timings (wall/cpu):")
+        for name, timing in sorted(metrics.snapshot()["timings"].items()):
+            if name.startswith("profile."):
+                lines.append(f"  {name[len('profile.'):]}: {timing['count']} calls, "
+                             f"avg {timing['avg_ms']}ms, max {timing['max_ms']}ms")
+
+        lines.append("")
+        lines.append("Top functions by samples:")
+        for function, count in self._sampler.top_functions(self.top):
+            share = count / max(1, self._sampler.samples) * 100
+            lines.append(f"  {share:5.1f}%  {function}")
+
+        if self._watched:
+            lines.append("")
+            lines.append("Watched containers (start -> end):")
+            for name, size in self._watched.items():
+                lines.append(f"  {name}: {self._sizes_before.get(name, 0)} -> {size()}")
+
+        if self._memory and self._memory_before is not None:
+            lines.append("")
+            lines.append("Top allocation growth:")
+            stats = tracemalloc.take_snapshot().compare_to(self._memory_before, "lineno")
+            for stat in stats[:self.top]:
+                lines.append(f"  {stat}")
+        return lines
+
+    def _write(self, report: List[str]):
+        for line in report:
+            logging.info(line)
+        os.makedirs(self.output_dir, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        with open(os.path.join(self.output_dir, f"profile-{stamp}.txt"), "w") as out:
+            out.write("\n".join(report) + "\n")
+        with open(os.path.join(self.output_dir, f"profile-{stamp}.collapsed"), "w") as out:
+            out.write("\n".join(self._sampler.collapsed()) + "\n")
+        logging.info("Profile written to %s/profile-%s.*", self.output_dir, stamp)
+
+
+class _Track:
+    __slots__ = ("profiler", "name", "wall", "cpu")
+
+    def __init__(self, profiler: Profiler, name: str):
+        self.profiler = profiler
+        self.name = name
+        self.wall = None
+
+    async def __aenter__(self):
+        if self.profiler.active:
+            self.wall = time.perf_counter()
+            self.cpu = time.thread_time()
+
+    async def __aexit__(self, *exc_info: Any):
+        if self.wall is not None:
+            _record(self.name, self.wall, self.cpu)
+
+
+# CPU time is measured on the event loop thread, so it also includes other
+# tasks that ran while the handler was waiting; compare it against wall time
+def _record(name: str, wall_started: float, cpu_started: float):
+    metrics.observe(f"profile.{name}.wall", time.perf_counter() - wall_started)
+    metrics.observe(f"profile.{name}.cpu", time.thread_time() - cpu_started)
+
+
+# Inner middleware timing message and callback handlers while profiling
+class HandlerTimingMiddleware(BaseMiddleware):
+    def __init__(self, profiler: Profiler):
+        self.profiler = profiler
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if not self.profiler.active:
+            return await handler(event, data)
+
+        handler_object = data.get("handler")
+        name = handler_object.callback.__name__ if handler_object else type(event).__name__
+        wall_started = time.perf_counter()
+        cpu_started = time.thread_time()
+        try:
+            return await handler(event, data)
+        finally:
+            _record(name, wall_started, cpu_started)
@@ -0,0 +1,80 @@
+# Token-bucket rate limiting for outgoing Bot API calls
+#
+# Telegram throttles bots globally (about 30 requests per second) and per
+# chat. Bulk work such as purges awaits `RateLimiter.acquire(chat_id)` before
+# every call, which waits until both the global bucket and the bucket of the
+# chat have a token, so it is paced instead of running into 429 errors.
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, Optional
+
+import metrics
+
+Clock = Callable[[], float]
+Sleep = Callable[[float], Awaitable[object]]
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float, clock: Clock = time.monotonic):
+        # Tokens added per second and the most tokens the bucket can hold
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.clock = clock
+        self.tokens = self.burst
+        self.updated_at = clock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    # Seconds until a token is available (0 if one is available now)
+    def delay(self) -> float:
+        self._refill(self.clock())
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self._refill(self.clock())
+        self.tokens -= 1
+
+
+class RateLimiter:
+    def __init__(self, rate: float = 30.0, burst: float = 30.0,
+                 per_key_rate: float = 1.0, per_key_burst: float = 5.0,
+                 clock: Clock = time.monotonic, sleep: Sleep = asyncio.sleep):
+        self.clock = clock
+        self.sleep = sleep
+        self.global_bucket = TokenBucket(rate, burst, clock)
+        self.per_key_rate = per_key_rate
+        self.per_key_burst = per_key_burst
+        self._buckets: Dict[int, TokenBucket] = {}
+
+    def _bucket(self, key: int) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.per_key_rate, self.per_key_burst, self.clock)
+        return bucket
+
+    # Wait for a token of the global bucket and, if given, of the key's bucket
+    async def acquire(self, key: Optional[int] = None):
+        buckets = [self.global_bucket] if key is None else [self.global_bucket, self._bucket(key)]
+        started = None
+        while True:
+            delay = max(bucket.delay() for bucket in buckets)
+            if delay <= 0:
+                break
+            if started is None:
+                started = self.clock()
+            await self.sleep(delay)
+        for bucket in buckets:
+            bucket.take()
+        if started is not None:
+            metrics.observe("ratelimit.wait", self.clock() - started)
+
+    # Drop per-key buckets that have refilled completely
+    def sweep(self):
+        now = self.clock()
+        for key in [key for key, bucket in self._buckets.items()
+                    if bucket.tokens + (now - bucket.updated_at) * bucket.rate >= bucket.burst]:
+            del self._buckets[key]
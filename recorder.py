@@ -0,0 +1,139 @@
+# Recording of incoming updates for later replay (see replay.py)
+#
+# The recorder is an outer update middleware that hands every update to a
+# writer thread, which redacts user identities and appends it with its arrival
+# time to a gzip-compressed JSONL file:
+#   {"ts": 1700000000.123, "update": {...}}
+# User ids are replaced by stable pseudonyms (the same user keeps the same id
+# within a recording, so per-user and per-chat patterns survive) and names,
+# usernames and phone numbers are dropped. Message texts are kept, because
+# commands and button data decide which handlers run.
+import gzip
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram.dispatcher.middlewares.base import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+import metrics
+
+# Keys whose value is a User object (or a list of them). Chat member updates
+# wrap the user in a ChatMember ("new_chat_member": {"user": ...}), which is
+# redacted through its "user" key.
+USER_KEYS = {"from", "user", "left_chat_member", "via_bot", "forward_from", "creator", "traveler", "watcher"}
+USER_LIST_KEYS = {"new_chat_members", "users"}
+# Personal fields dropped from users, private chats and contacts
+PERSONAL_KEYS = {"first_name", "last_name", "username", "language_code", "bio", "phone_number", "vcard"}
+# Names of people without a User object, dropped wherever they appear
+NAME_KEYS = {"forward_sender_name", "author_signature"}
+
+
+class Redactor:
+    def __init__(self, salt: Optional[bytes] = None):
+        # A fresh random salt per recording, so pseudonyms cannot be matched across recordings
+        self.salt = salt or os.urandom(16)
+        self._pseudonyms: Dict[int, int] = {}
+
+    def pseudonym(self, user_id: int) -> int:
+        pseudonym = self._pseudonyms.get(user_id)
+        if pseudonym is None:
+            digest = hashlib.blake2b(str(user_id).encode(), key=self.salt, digest_size=4).digest()
+            # Positive 31-bit ids, like real user ids
+            pseudonym = self._pseudonyms[user_id] = int.from_bytes(digest, "big") >> 1 or 1
+        return pseudonym
+
+    def _user(self, user: Dict[str, Any]) -> Dict[str, Any]:
+        redacted = {key: value for key, value in user.items() if key not in PERSONAL_KEYS}
+        if "id" in redacted and not redacted.get("is_bot"):
+            redacted["id"] = self.pseudonym(redacted["id"])
+        redacted["first_name"] = f"user{redacted.get('id', '')}"
+        return redacted
+
+    def redact(self, value: Any) -> Any:
+        if isinstance(value, list):
+            return [self.redact(item) for item in value]
+        if not isinstance(value, dict):
+            return value
+
+        redacted: Dict[str, Any] = {}
+        for key, item in value.items():
+            if key in NAME_KEYS:
+                continue
+            if key in USER_KEYS and isinstance(item, dict):
+                redacted[key] = self._user(item)
+            elif key in USER_LIST_KEYS and isinstance(item, list):
+                redacted[key] = [self._user(user) for user in item]
+            elif key == "chat" and isinstance(item, dict) and item.get("type") == "private":
+                # A private chat's id is the user's id
+                chat = {key: value for key, value in item.items() if key not in PERSONAL_KEYS}
+                chat["id"] = self.pseudonym(chat["id"])
+                redacted[key] = chat
+            elif key == "contact" and isinstance(item, dict):
+                contact = {key: value for key, value in item.items() if key not in PERSONAL_KEYS}
+                if "user_id" in contact:
+                    contact["user_id"] = self.pseudonym(contact["user_id"])
+                redacted[key] = contact
+            else:
+                redacted[key] = self.redact(item)
+        return redacted
+
+
+def _encode(value: Any) -> Any:
+    # Message dates are datetimes after parsing; the Bot API sends unix time
+    if hasattr(value, "timestamp"):
+        return int(value.timestamp())
+    raise TypeError(f"cannot encode {type(value).__name__}")
+
+
+class UpdateRecorder(BaseMiddleware):
+    def __init__(self, path: str, queue_size: int = 10000):
+        self.path = path
+        self.redactor = Redactor()
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._thread: Optional[threading.Thread] = None
+
+    # Start writing; shard workers record to their own file (path.<shard>)
+    def start(self, suffix: str = ""):
+        if self._thread is not None:
+            return
+        self.path = self.path + suffix
+        self._thread = threading.Thread(target=self._write, name="update-recorder", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+
+    def _write(self):
+        # Append mode adds a new gzip member per run; gzip readers handle that
+        with gzip.open(self.path, "at", encoding="utf-8") as out:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    break
+                received_at, raw = item
+                line = json.dumps({"ts": received_at, "update": self.redactor.redact(raw)},
+                                  default=_encode, ensure_ascii=False)
+                out.write(line + "\n")
+                metrics.inc("recorder.written")
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if self._thread is not None and isinstance(event, Update):
+            try:
+                self._queue.put_nowait((time.time(), event.dict(by_alias=True, exclude_none=True)))
+            except queue.Full:
+                metrics.inc("recorder.dropped")
+        return await handler(event, data)
@@ -0,0 +1,175 @@
+# Replay of recorded update streams (see recorder.py) at accelerated speed
+#
+# Feeds a recording through the bot's dispatcher against the local fake Bot
+# API, keeping the recorded gaps between updates divided by --speed. The event
+# loop runs on virtual time at the same speed, so scheduled deletions and
+# maintenance jobs fire as they would have in production, only sooner:
+#   RECORD_UPDATES=updates.jsonl.gz python main.py      # record in production
+#   python replay.py updates.jsonl.gz --speed 20        # replay locally
+# Recordings of sharded workers (updates.jsonl.gz.0, .1, ...) can be passed
+# together and are merged by arrival time.
+#
+# The rate limiter and the admin cache use the loop's clock too, so API pacing
+# and cache expiry happen at replay speed. HTTP timeouts and keep-alive are
+# multiplied by --speed so they still last as long in real time as configured.
+# Wall-clock timestamps (time.time(), e.g. the due times in the state store and
+# the lag metrics) are not scaled.
+import argparse
+import asyncio
+import gzip
+import heapq
+import json
+import os
+import selectors
+import statistics
+import sys
+import time
+from typing import Any, Dict, Iterator, List, Tuple
+
+from fake_api import percentile, start_fake_api_process
+
+
+def read_recording(path: str) -> Iterator[Tuple[float, Dict[str, Any]]]:
+    with gzip.open(path, "rt", encoding="utf-8") as recording:
+        for line in recording:
+            if line.strip():
+                record = json.loads(line)
+                yield record["ts"], record["update"]
+
+
+# Selector that waits `speed` times shorter than asked, matching the loop's clock
+def scaled_selector(speed: float) -> selectors.BaseSelector:
+    base = type(selectors.DefaultSelector())
+
+    class ScaledSelector(base):
+        def select(self, timeout=None):
+            return super().select(None if timeout is None else timeout / speed)
+
+    return ScaledSelector()
+
+
+# Event loop whose clock runs `speed` times faster than real time. asyncio.sleep,
+# call_later and wait_for timeouts all use this clock, so a 60 second deletion
+# timer fires after 60 / speed real seconds.
+class VirtualTimeLoop(asyncio.SelectorEventLoop):
+    def __init__(self, speed: float):
+        super().__init__(scaled_selector(speed))
+        self.speed = speed
+        self._real_start = time.monotonic()
+
+    def time(self) -> float:
+        return self._real_start + (time.monotonic() - self._real_start) * self.speed
+
+
+async def replay(records: List[Tuple[float, Dict[str, Any]]], speed: float, drain: float) -> Dict[str, Any]:
+    import main as bot_main
+    import metrics
+    from aiogram.types import Update
+
+    dp, bot = bot_main.dp, bot_main.bot
+    loop = asyncio.get_running_loop()
+    bot_main.clock_source = loop.time
+    workflow_data = {"dispatcher": dp, "bots": [bot], "bot": bot}
+    await dp.emit_startup(**workflow_data)
+
+    # How late each update was fed compared to its recorded offset (virtual seconds)
+    feed_lag: List[float] = []
+    first_ts = records[0][0]
+    started = loop.time()
+    real_started = time.perf_counter()
+    try:
+        for received_at, raw in records:
+            offset = received_at - first_ts
+            delay = offset - (loop.time() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            feed_lag.append(max(0.0, loop.time() - started - offset))
+            try:
+                await dp.feed_update(bot, Update(**raw))
+            except Exception as e:
+                metrics.inc(f"replay.errors.{type(e).__name__}")
+        fed_after = time.perf_counter() - real_started
+
+        # feed_update only queues updates on the lanes; let them be handled first
+        await bot_main.update_lanes.join()
+        
+        # Let pending deletions come due, in virtual time
+        deadline = loop.time() + drain
+        while (bot_main.scheduled_messages or bot_main.catchup_drainer.active) and loop.time() < deadline:
+            await asyncio.sleep(1)
+    finally:
+        await dp.emit_shutdown(**workflow_data)
+        await bot.session.close()
+
+    return {
+        "updates": len(records),
+        "recorded_seconds": records[-1][0] - first_ts,
+        "fed_after": fed_after,
+        "feed_lag": feed_lag,
+        "left_scheduled": len(bot_main.scheduled_messages),
+        "metrics": metrics.snapshot(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded updates against the local fake Bot API")
+    parser.add_argument("recordings", nargs="+", help="gzip JSONL files written by the update recorder")
+    parser.add_argument("--speed", type=float, default=10.0, help="replay speed, 1 to 100 times real time")
+    parser.add_argument("--drain", type=float, default=3600.0,
+                        help="virtual seconds to wait for pending deletions after the last update")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="latency of the fake Bot API")
+    parser.add_argument("--state-db", default="", help="SQLite store to use (disabled by default)")
+    args = parser.parse_args()
+    if not 1 <= args.speed <= 100:
+        parser.error("--speed must be between 1 and 100")
+
+    records = list(heapq.merge(*(read_recording(path) for path in args.recordings), key=lambda record: record[0]))
+    if not records:
+        parser.error("the recordings contain no updates")
+
+    fake_api, port = start_fake_api_process(args.latency_ms / 1000)
+
+    # The bot module reads its configuration on import
+    os.environ["BOT_API_URL"] = f"http://127.0.0.1:{port}"
+    os.environ["STATE_DB"] = args.state_db
+    os.environ["PREWARM_CONCURRENCY"] = "0"
+    # Keep the timings of the whole run instead of the last rollup window
+    os.environ["METRICS_ROLLUP_INTERVAL"] = str(10 ** 9)
+    os.environ.pop("RECORD_UPDATES", None)
+    os.environ.setdefault("BOT_TOKEN", "123456:replay")
+    # aiohttp measures these on the loop's clock; keep them at their real-time length
+    # (the defaults are main.py's)
+    for name, default in (("HTTP_CONNECT_TIMEOUT", "5"), ("HTTP_TIMEOUT", "60"), ("HTTP_KEEPALIVE", "60")):
+        os.environ[name] = str(float(os.getenv(name, default)) * args.speed)
+    import logging
+    logging.disable(logging.INFO)
+
+    loop = VirtualTimeLoop(args.speed)
+    asyncio.set_event_loop(loop)
+    try:
+        result = loop.run_until_complete(replay(records, args.speed, args.drain))
+    finally:
+        loop.close()
+        fake_api.terminate()
+
+    counters = result["metrics"]["counters"]
+    timings = result["metrics"]["timings"]
+    lag = result["feed_lag"]
+    print(f"{result['updates']} updates recorded over {result['recorded_seconds']:.0f}s, replayed at {args.speed:g}x")
+    print(f"fed in {result['fed_after']:.1f}s real time "
+          f"({result['updates'] / max(result['fed_after'], 1e-9):.0f} updates/s)")
+    print(f"feed lag behind schedule (virtual s): median {statistics.median(lag):.3f}, "
+          f"p99 {percentile(lag, 0.99):.3f}, max {max(lag):.3f}")
+    print(f"deletions still pending at the end: {result['left_scheduled']}")
+    for name in ("lanes.processed", "lanes.shed", "lanes.saturated", "updates.duplicates"):
+        print(f"  {name}: {counters.get(name, 0)}")
+    for name, timing in sorted(timings.items()):
+        if name.startswith("api."):
+            print(f"  {name}: {timing['count']} calls, avg {timing['avg_ms']}ms, max {timing['max_ms']}ms")
+    errors = {name: count for name, count in counters.items() if name.startswith("replay.errors.")}
+    if errors:
+        print(f"errors: {errors}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+# Multi-process sharding of update handling
+#
+# A front process receives raw updates (long polling or webhook) and routes
+# them by chat id hash to N worker processes. Each worker runs the regular
+# dispatcher on its own event loop and owns the scheduler and settings cache
+# of its chats; durable state lives in the shared SQLite store.
+import asyncio
+import logging
+import multiprocessing
+import queue
+import signal
+from typing import Any, Dict, List, Optional, Tuple
+
+from aiohttp import ClientSession, ClientTimeout, web
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+import metrics
+
+# Update fields that carry a chat, in the order they are checked
+CHAT_UPDATE_FIELDS = (
+    "message", "edited_message", "channel_post", "edited_channel_post",
+    "my_chat_member", "chat_member", "chat_join_request"
+)
+
+# Sentinel telling a worker to finish its queue and exit
+STOP = None
+
+
+def shard_for(chat_id: int, shard_count: int) -> int:
+    return chat_id % shard_count
+
+
+# Find the chat id of a raw update without parsing it into aiogram types
+def update_chat_id(raw: Dict[str, Any]) -> int:
+    for field in CHAT_UPDATE_FIELDS:
+        event = raw.get(field)
+        if event is not None:
+            return event["chat"]["id"]
+    callback = raw.get("callback_query")
+    if callback is not None:
+        message = callback.get("message")
+        if message is not None:
+            return message["chat"]["id"]
+        return callback["from"]["id"]
+    for event in raw.values():
+        if isinstance(event, dict) and "from" in event:
+            return event["from"]["id"]
+    return 0
+
+
+# Runs inside a worker process: feed routed updates into the dispatcher
+def _worker_main(dp: Dispatcher, bot: Bot, shard_index: int, shard_count: int,
+                 updates: multiprocessing.Queue, ready: multiprocessing.Queue):
+    # Ctrl+C reaches the whole process group, the front decides when to stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        workflow_data = {
+            "dispatcher": dp, "bots": [bot], "bot": bot,
+            "shard_index": shard_index, "shard_count": shard_count,
+        }
+        await dp.emit_startup(**workflow_data)
+        ready.put(shard_index)
+        processed = 0
+        try:
+            while True:
+                raw = await loop.run_in_executor(None, updates.get)
+                if raw is STOP:
+                    break
+                try:
+                    await dp.feed_update(bot, Update(**raw))
+                except Exception:
+                    logging.exception("Worker %d failed to process update %s", shard_index, raw.get("update_id"))
+                processed += 1
+        finally:
+            await dp.emit_shutdown(**workflow_data)
+            await bot.session.close()
+        ready.put((shard_index, processed))
+
+    asyncio.run(run())
+
+
+class ShardedRunner:
+    def __init__(self, dp: Dispatcher, bot: Bot, worker_count: int, queue_size: int = 1000):
+        self.dp = dp
+        self.bot = bot
+        self.worker_count = max(1, worker_count)
+        self.queue_size = queue_size
+        # Workers are forked so they inherit the already configured dispatcher
+        self._context = multiprocessing.get_context("fork")
+        self._queues: List[multiprocessing.Queue] = []
+        self._processes: List[multiprocessing.Process] = []
+        self._ready = self._context.Queue()
+
+    # Fork the workers; must run before the front starts its event loop
+    def start_workers(self):
+        for index in range(self.worker_count):
+            updates = self._context.Queue(maxsize=self.queue_size)
+            process = self._context.Process(
+                target=_worker_main,
+                args=(self.dp, self.bot, index, self.worker_count, updates, self._ready),
+                name=f"bot-worker-{index}",
+                daemon=True
+            )
+            process.start()
+            self._queues.append(updates)
+            self._processes.append(process)
+        for _ in range(self.worker_count):
+            self._ready.get()
+
+    # Route one raw update to its worker, waiting while that worker is full
+    async def route(self, raw: Dict[str, Any]):
+        index = shard_for(update_chat_id(raw), self.worker_count)
+        updates = self._queues[index]
+        try:
+            updates.put_nowait(raw)
+        except queue.Full:
+            metrics.inc("shards.backpressure")
+            await asyncio.get_running_loop().run_in_executor(None, updates.put, raw)
+        metrics.inc(f"shards.routed.{index}")
+
+    # Ask every worker to finish its queue and wait for them to exit
+    def stop_workers(self, timeout: float = 30.0) -> Dict[int, int]:
+        for updates in self._queues:
+            updates.put(STOP)
+        processed: Dict[int, int] = {}
+        for _ in self._processes:
+            try:
+                index, count = self._ready.get(timeout=timeout)
+                processed[index] = count
+            except queue.Empty:
+                break
+        for process in self._processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        self._processes.clear()
+        self._queues.clear()
+        return processed
+
+    # Long polling intake that routes raw JSON updates without parsing them
+    async def poll(self, polling_timeout: int = 10):
+        url = self.bot.session.api.api_url(token=self.bot.token, method="getUpdates")
+        offset = 0
+        async with ClientSession(timeout=ClientTimeout(total=polling_timeout + 30)) as session:
+            while True:
+                try:
+                    async with session.post(url, json={"offset": offset, "timeout": polling_timeout}) as resp:
+                        payload = self.bot.session.json_loads(await resp.read())
+                except Exception as e:
+                    logging.error("Failed to fetch updates - %s: %s", type(e).__name__, e)
+                    await asyncio.sleep(1)
+                    continue
+                if not payload.get("ok"):
+                    logging.error("getUpdates failed: %s", payload.get("description"))
+                    await asyncio.sleep(1)
+                    continue
+                for raw in payload["result"]:
+                    await self.route(raw)
+                    offset = raw["update_id"] + 1
+
+    # Webhook intake: Telegram retries until the update has been queued
+    def webhook_app(self, path: str) -> web.Application:
+        async def receive(request: web.Request) -> web.Response:
+            await self.route(await request.json())
+            return web.Response()
+
+        app = web.Application()
+        app.router.add_post(path, receive)
+        return app
+
+    async def serve_webhook(self, url: str, host: str, port: int, path: str):
+        await self.bot.set_webhook(url)
+        runner = web.AppRunner(self.webhook_app(path), access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await runner.cleanup()
+            await self.bot.session.close()
+
+
+# Entry point of the sharded deployment mode
+def run_sharded(dp: Dispatcher, bot: Bot, worker_count: int, queue_size: int = 1000,
+                webhook: Optional[Tuple[str, str, int, str]] = None):
+    runner = ShardedRunner(dp, bot, worker_count, queue_size)
+    runner.start_workers()
+    logging.info("Started %d worker processes", worker_count)
+
+    async def front():
+        if webhook:
+            await runner.serve_webhook(*webhook)
+        else:
+            await bot.delete_webhook()
+            await bot.session.close()
+            await runner.poll()
+
+    try:
+        asyncio.run(front())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        runner.stop_workers()
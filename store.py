@@ -0,0 +1,352 @@
+# Shared local SQLite store for bot state
+#
+# Group settings, deletion policies and pending deletions are written here so
+# that they survive restarts and can be shared by several worker processes on
+# one machine.
+#
+# Once `start_writer()` was called, writes made from the event loop are queued
+# to a background thread, which commits whatever has queued up in one
+# transaction. A busy database (another worker holding the write lock for up
+# to the 5 second busy timeout) then delays those writes, not update handling.
+# A batch that still fails stays at the head of the queue and is retried with
+# backoff, so pending deletions are never lost to a locked database.
+# Writes keep their order; reads and lease operations run directly.
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+import metrics
+
+# Longest wait between retries of a batch the database refused
+MAX_RETRY_DELAY = 5.0
+# How long stop_writer keeps retrying before giving up on what is left
+STOP_RETRY_TIMEOUT = 30.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chat_settings (
+    chat_id INTEGER PRIMARY KEY,
+    enabled INTEGER NOT NULL,
+    default_time INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pending_deletions (
+    chat_id INTEGER NOT NULL,
+    message_id INTEGER NOT NULL,
+    due_at REAL NOT NULL,
+    lease_owner TEXT,
+    lease_until REAL,
+    PRIMARY KEY (chat_id, message_id)
+);
+CREATE INDEX IF NOT EXISTS pending_deletions_due ON pending_deletions (due_at);
+CREATE TABLE IF NOT EXISTS chat_policies (
+    chat_id INTEGER NOT NULL,
+    content_class TEXT NOT NULL,
+    sender_class TEXT NOT NULL,
+    ttl INTEGER,
+    PRIMARY KEY (chat_id, content_class, sender_class)
+);
+"""
+
+
+class StateStore:
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+        self._writes: "queue.Queue[Optional[Tuple[str, List[Tuple]]]]" = queue.Queue()
+        self._writer: Optional[threading.Thread] = None
+        self._writer_pid: Optional[int] = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    # Open the connection lazily; forked worker processes get their own one
+    def connection(self) -> sqlite3.Connection:
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            # Stores created before deletion leases existed lack the lease columns
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(pending_deletions)")}
+            if "lease_owner" not in columns:
+                conn.execute("ALTER TABLE pending_deletions ADD COLUMN lease_owner TEXT")
+                conn.execute("ALTER TABLE pending_deletions ADD COLUMN lease_until REAL")
+            self._conn = conn
+            self._pid = os.getpid()
+        return self._conn
+
+    def close(self):
+        self.stop_writer()
+        if self._conn is not None and self._pid == os.getpid():
+            self._conn.close()
+        self._conn = None
+
+    # Background writer ---------------------------------------------------
+
+    @property
+    def writer_running(self) -> bool:
+        # A forked worker does not inherit the parent's writer thread
+        return self._writer is not None and self._writer_pid == os.getpid()
+
+    def start_writer(self):
+        if self.writer_running or not self.enabled:
+            return
+        self._writes = queue.Queue()
+        self._writer = threading.Thread(target=self._run_writer, name="store-writer", daemon=True)
+        self._writer_pid = os.getpid()
+        self._writer.start()
+
+    # Commit everything queued so far, then stop the thread
+    def stop_writer(self):
+        if not self.writer_running:
+            return
+        self._writes.put(None)
+        self._writer.join()
+        self._writer = None
+
+    def _run_writer(self):
+        pending: List[Tuple[str, List[Tuple]]] = []
+        failures = 0
+        stopping = False
+        stop_deadline = None
+        while not (stopping and not pending):
+            if not pending:
+                batch = [self._writes.get()]
+            else:
+                batch = []
+            while True:
+                try:
+                    batch.append(self._writes.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batch and not stopping:
+                stopping = True
+                stop_deadline = time.monotonic() + STOP_RETRY_TIMEOUT
+            # New writes go behind the ones still waiting to be committed
+            pending.extend(write for write in batch if write is not None)
+            if not pending:
+                continue
+            try:
+                self._commit(pending)
+                pending = []
+                failures = 0
+            except sqlite3.OperationalError as e:
+                # Usually "database is locked" after the busy timeout
+                failures += 1
+                metrics.inc("store.write_retries")
+                if stopping and time.monotonic() >= stop_deadline:
+                    metrics.inc("store.write_failed", len(pending))
+                    logging.error("Gave up on %d store writes at shutdown: %s", len(pending), e)
+                    return
+                logging.warning("Store writes failed (attempt %d), retrying %d writes: %s",
+                                failures, len(pending), e)
+                time.sleep(min(MAX_RETRY_DELAY, 0.1 * 2 ** failures))
+            except sqlite3.Error:
+                # A write the database rejects outright would fail every retry
+                pending = self._commit_each(pending)
+
+    # Commit the writes in one transaction
+    def _commit(self, writes: List[Tuple[str, List[Tuple]]]):
+        with self._lock:
+            conn = self.connection()
+            conn.execute("BEGIN")
+            try:
+                for sql, rows in writes:
+                    conn.executemany(sql, rows)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        metrics.inc("store.writes", len(writes))
+
+    # Commit the writes one by one, dropping only the ones that are rejected.
+    # Returns the writes left over when the database became unavailable.
+    def _commit_each(self, writes: List[Tuple[str, List[Tuple]]]) -> List[Tuple[str, List[Tuple]]]:
+        for index, (sql, rows) in enumerate(writes):
+            try:
+                self._commit([(sql, rows)])
+            except sqlite3.OperationalError:
+                return writes[index:]
+            except sqlite3.Error as e:
+                metrics.inc("store.write_failed")
+                logging.error("Dropped store write %r: %s", sql, e)
+        return []
+
+    # Queue the write while the writer runs, otherwise write right away
+    def _write(self, sql: str, rows: List[Tuple]):
+        if not rows:
+            return
+        if self.writer_running:
+            self._writes.put((sql, rows))
+        else:
+            self._executemany(sql, rows)
+
+    def _execute(self, sql: str, params: Tuple = ()) -> sqlite3.Cursor:
+        with self._lock:
+            return self.connection().execute(sql, params)
+
+    def _executemany(self, sql: str, rows: List[Tuple]):
+        with self._lock:
+            conn = self.connection()
+            conn.execute("BEGIN")
+            try:
+                conn.executemany(sql, rows)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    # Settings ------------------------------------------------------------
+
+    def save_settings(self, chat_id: int, enabled: bool, default_time: int):
+        self._write(
+            "INSERT INTO chat_settings (chat_id, enabled, default_time) VALUES (?, ?, ?) "
+            "ON CONFLICT(chat_id) DO UPDATE SET enabled = excluded.enabled, default_time = excluded.default_time",
+            [(chat_id, int(enabled), default_time)]
+        )
+
+    def save_all_settings(self, rows: List[Tuple[int, bool, int]]):
+        self._write(
+            "INSERT INTO chat_settings (chat_id, enabled, default_time) VALUES (?, ?, ?) "
+            "ON CONFLICT(chat_id) DO UPDATE SET enabled = excluded.enabled, default_time = excluded.default_time",
+            [(chat_id, int(enabled), default_time) for chat_id, enabled, default_time in rows]
+        )
+
+    # Returns {chat_id: (enabled, default_time)}, optionally for one shard only
+    def load_settings(self, shard_index: int = 0, shard_count: int = 1) -> Dict[int, Tuple[bool, int]]:
+        rows = self._execute("SELECT chat_id, enabled, default_time FROM chat_settings").fetchall()
+        return {
+            chat_id: (bool(enabled), default_time)
+            for chat_id, enabled, default_time in rows
+            if chat_id % shard_count == shard_index
+        }
+
+    # Deletion policies ---------------------------------------------------
+
+    # A ttl of None keeps matching messages
+    def save_policy_rule(self, chat_id: int, content: str, sender: str, ttl: Optional[int]):
+        self._write(
+            "INSERT OR REPLACE INTO chat_policies (chat_id, content_class, sender_class, ttl) VALUES (?, ?, ?, ?)",
+            [(chat_id, content, sender, ttl)]
+        )
+
+    def remove_policy_rule(self, chat_id: int, content: str, sender: str):
+        self._write(
+            "DELETE FROM chat_policies WHERE chat_id = ? AND content_class = ? AND sender_class = ?",
+            [(chat_id, content, sender)]
+        )
+
+    def clear_policy(self, chat_id: int):
+        self._write("DELETE FROM chat_policies WHERE chat_id = ?", [(chat_id,)])
+
+    # Returns {chat_id: {(content, sender): ttl}}, optionally for one shard only
+    def load_policies(self, shard_index: int = 0, shard_count: int = 1) -> Dict[int, Dict[Tuple[str, str], Optional[int]]]:
+        policies: Dict[int, Dict[Tuple[str, str], Optional[int]]] = {}
+        rows = self._execute("SELECT chat_id, content_class, sender_class, ttl FROM chat_policies").fetchall()
+        for chat_id, content, sender, ttl in rows:
+            if chat_id % shard_count == shard_index:
+                policies.setdefault(chat_id, {})[(content, sender)] = ttl
+        return policies
+
+    # Pending deletions ---------------------------------------------------
+
+    def add_deletion(self, chat_id: int, message_id: int, due_at: float):
+        self._write(
+            "INSERT OR REPLACE INTO pending_deletions (chat_id, message_id, due_at, lease_owner, lease_until) "
+            "VALUES (?, ?, ?, NULL, NULL)",
+            [(chat_id, message_id, due_at)]
+        )
+
+    def remove_deletion(self, chat_id: int, message_id: int):
+        self._write(
+            "DELETE FROM pending_deletions WHERE chat_id = ? AND message_id = ?",
+            [(chat_id, message_id)]
+        )
+
+    def remove_deletions(self, chat_id: int, message_ids: List[int]):
+        self._write(
+            "DELETE FROM pending_deletions WHERE chat_id = ? AND message_id = ?",
+            [(chat_id, message_id) for message_id in message_ids]
+        )
+
+    # Returns [(chat_id, message_id, due_at)] ordered by due time
+    def load_deletions(self, shard_index: int = 0, shard_count: int = 1) -> List[Tuple[int, int, float]]:
+        rows = self._execute(
+            "SELECT chat_id, message_id, due_at FROM pending_deletions ORDER BY due_at"
+        ).fetchall()
+        return [row for row in rows if row[0] % shard_count == shard_index]
+
+    # Leases --------------------------------------------------------------
+
+    # Claim up to `limit` due deletions that nobody holds a valid lease on.
+    # BEGIN IMMEDIATE takes the write lock up front, so two replicas can never
+    # select and lease the same rows (SQLite's take on SELECT ... FOR UPDATE).
+    def claim_due(self, owner: str, now: float, lease_seconds: float, limit: int = 100) -> List[Tuple[int, int, float]]:
+        with self._lock:
+            conn = self.connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = conn.execute(
+                    "SELECT rowid, chat_id, message_id, due_at FROM pending_deletions "
+                    "WHERE due_at <= ? AND (lease_until IS NULL OR lease_until < ?) "
+                    "ORDER BY due_at LIMIT ?",
+                    (now, now, limit)
+                ).fetchall()
+                conn.executemany(
+                    "UPDATE pending_deletions SET lease_owner = ?, lease_until = ? WHERE rowid = ?",
+                    [(owner, now + lease_seconds, row[0]) for row in rows]
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return [(chat_id, message_id, due_at) for _, chat_id, message_id, due_at in rows]
+
+    # Extend this owner's leases; returns the rows it still holds. A row whose
+    # lease ran out is only lost once another owner claimed it.
+    def renew_leases(self, rows: List[Tuple[int, int]], owner: str, now: float,
+                     lease_seconds: float) -> Set[Tuple[int, int]]:
+        held = set()
+        with self._lock:
+            conn = self.connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for chat_id, message_id in rows:
+                    cursor = conn.execute(
+                        "UPDATE pending_deletions SET lease_until = ? "
+                        "WHERE chat_id = ? AND message_id = ? AND lease_owner = ?",
+                        (now + lease_seconds, chat_id, message_id, owner)
+                    )
+                    if cursor.rowcount:
+                        held.add((chat_id, message_id))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return held
+
+    # Drop a deletion this owner has attempted
+    def complete_deletion(self, chat_id: int, message_id: int, owner: str):
+        self._execute(
+            "DELETE FROM pending_deletions WHERE chat_id = ? AND message_id = ? AND lease_owner = ?",
+            (chat_id, message_id, owner)
+        )
+
+    # Give a leased deletion back so it is retried at `retry_at`
+    def release_deletion(self, chat_id: int, message_id: int, owner: str, retry_at: float):
+        self._execute(
+            "UPDATE pending_deletions SET due_at = ?, lease_owner = NULL, lease_until = NULL "
+            "WHERE chat_id = ? AND message_id = ? AND lease_owner = ?",
+            (retry_at, chat_id, message_id, owner)
+        )
+
+    # Due time of the earliest deletion, or None if nothing is pending
+    def next_due(self) -> Optional[float]:
+        row = self._execute("SELECT MIN(due_at) FROM pending_deletions").fetchone()
+        return row[0] if row else None
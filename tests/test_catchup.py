@@ -0,0 +1,112 @@
+import asyncio
+
+import pytest
+from aiogram.exceptions import TelegramForbiddenError, TelegramNetworkError
+
+from catchup import CatchUpDrainer
+from ratelimit import RateLimiter
+
+
+class FakeBot:
+    def __init__(self, failures=None):
+        self.calls = []
+        # chat_id -> exceptions to raise on the next calls for that chat
+        self.failures = failures or {}
+
+    async def __call__(self, method):
+        self.calls.append((method.chat_id, list(method.message_ids)))
+        pending = self.failures.get(method.chat_id)
+        if pending:
+            raise pending.pop(0)(method=method, message="failed")
+        return True
+
+
+def drain(drainer: CatchUpDrainer, rows):
+    for chat_id, message_id, due_at in rows:
+        drainer.add(chat_id, message_id, due_at)
+
+    async def run():
+        drainer.start()
+        while drainer.active:
+            await asyncio.sleep(0)
+        await drainer.stop()
+
+    asyncio.run(run())
+
+
+async def no_backoff(delay):
+    await asyncio.sleep(0)
+
+
+def make_drainer(bot, **kwargs):
+    limiter = RateLimiter(rate=10_000, burst=10_000, per_key_rate=10_000, per_key_burst=10_000)
+    return CatchUpDrainer(bot, limiter, batch_size=2, sleep=no_backoff, **kwargs)
+
+
+def test_chats_take_turns_oldest_first():
+    bot = FakeBot()
+    # Rows arrive in due order, like the store returns them
+    rows = [(-1, 1, 1.0), (-1, 2, 2.0), (-2, 1, 3.0), (-1, 3, 4.0), (-1, 4, 5.0), (-3, 1, 6.0), (-1, 5, 7.0)]
+    drain(make_drainer(bot), rows)
+    assert bot.calls == [(-1, [1, 2]), (-2, [1]), (-3, [1]), (-1, [3, 4]), (-1, [5])]
+
+
+def test_chat_added_later_with_older_work_goes_first():
+    bot = FakeBot()
+    # -2 was handed over after -1 (e.g. after a 429) but has waited longer
+    drain(make_drainer(bot), [(-1, 1, 50.0), (-1, 2, 51.0), (-1, 3, 52.0), (-2, 7, 10.0)])
+    assert bot.calls == [(-2, [7]), (-1, [1, 2]), (-1, [3])]
+
+
+def test_each_chat_gets_one_turn_per_round():
+    bot = FakeBot()
+    # -1 holds all the oldest work but cannot take two turns in a row while -2 waits
+    rows = [(-1, message_id, float(message_id)) for message_id in range(1, 7)] + [(-2, 1, 100.0)]
+    drain(make_drainer(bot), rows)
+    assert bot.calls == [(-1, [1, 2]), (-2, [1]), (-1, [3, 4]), (-1, [5, 6])]
+
+
+def test_late_rows_are_sorted_into_their_chat():
+    bot = FakeBot()
+    drain(make_drainer(bot), [(-1, 10, 5.0), (-1, 11, 6.0), (-1, 9, 1.0)])
+    assert bot.calls == [(-1, [9, 10]), (-1, [11])]
+
+
+def test_kept_and_discarded_messages_are_not_deleted():
+    bot = FakeBot()
+    done = []
+
+    async def on_done(chat_id, message_ids):
+        done.append((chat_id, message_ids))
+
+    drainer = make_drainer(bot, keep=lambda chat_id, ids: [i for i in ids if i != 2], done=on_done)
+    drainer.add(-1, 4, 4.0)
+    drainer.discard(-1, [4])
+    drain(drainer, [(-1, 1, 1.0), (-1, 2, 2.0)])
+    assert bot.calls == [(-1, [1])]
+    # Kept messages no longer need their stored deletion either
+    assert done == [(-1, [1, 2])]
+
+
+def test_failed_batches_are_retried_then_dropped():
+    bot = FakeBot({-1: [TelegramNetworkError] * 2, -2: [TelegramForbiddenError]})
+    done = []
+
+    async def on_done(chat_id, message_ids):
+        done.append((chat_id, message_ids))
+
+    drain(make_drainer(bot, done=on_done, max_attempts=5), [(-1, 1, 1.0), (-2, 1, 2.0)])
+    # The network errors are retried; a removed bot is given up on at once
+    assert bot.calls == [(-1, [1]), (-2, [1]), (-1, [1]), (-1, [1])]
+    assert sorted(done) == [(-2, [1]), (-1, [1])]
+
+
+def test_eta_follows_the_limiter_rates():
+    limiter = RateLimiter(rate=10, burst=10, per_key_rate=1)
+    drainer = CatchUpDrainer(FakeBot(), limiter, batch_size=100)
+    for message_id in range(250):
+        drainer.add(-1, message_id, float(message_id))
+    drainer.add(-2, 1, 1.0)
+    # Three batches in the big chat at one call per second per chat
+    assert drainer.eta() == pytest.approx(3.0)
+    assert len(drainer) == 251
@@ -0,0 +1,47 @@
+from dedupe import UpdateIdWindow
+
+
+def test_new_ids_are_not_duplicates():
+    window = UpdateIdWindow(size=8)
+    assert [window.check_and_mark(update_id) for update_id in range(1, 6)] == [False] * 5
+
+
+def test_repeated_id_is_a_duplicate():
+    window = UpdateIdWindow(size=8)
+    window.check_and_mark(10)
+    window.check_and_mark(11)
+    assert window.check_and_mark(10)
+    assert window.check_and_mark(11)
+
+
+def test_out_of_order_ids_inside_the_window_are_accepted():
+    window = UpdateIdWindow(size=8)
+    window.check_and_mark(20)
+    assert not window.check_and_mark(17)
+    assert window.check_and_mark(17)
+
+
+def test_ids_older_than_the_window_count_as_seen():
+    window = UpdateIdWindow(size=8)
+    window.check_and_mark(100)
+    assert window.check_and_mark(92)
+    assert not window.check_and_mark(93)
+
+
+def test_slot_reuse_forgets_the_older_id_only():
+    window = UpdateIdWindow(size=4)
+    window.check_and_mark(1)
+    window.check_and_mark(5)
+    # 1 and 5 share a slot, but 1 is now older than the window
+    assert window.check_and_mark(1)
+    assert window.check_and_mark(5)
+
+
+def test_window_starts_over_after_a_quiet_period():
+    clock = [1000.0]
+    window = UpdateIdWindow(size=8, reset_after=60, clock=lambda: clock[0])
+    window.check_and_mark(500)
+    clock[0] += 61
+    # Telegram may restart numbering at a lower id after a long pause
+    assert not window.check_and_mark(3)
+    assert not window.check_and_mark(500)
@@ -0,0 +1,24 @@
+import pytest
+
+from durations import parse_duration
+
+
+@pytest.mark.parametrize("text, seconds", [
+    ("90", 90),
+    ("0", 0),
+    ("45s", 45),
+    ("10m", 600),
+    ("2h35m10s", 2 * 3600 + 35 * 60 + 10),
+    ("1d", 86400),
+    ("1h30s", 3630),
+    ("2H5M", 7500),
+    (" 2h 35m ", 9300),
+])
+def test_valid_durations(text, seconds):
+    assert parse_duration(text) == seconds
+
+
+@pytest.mark.parametrize("text", ["", "   ", "h", "10x", "1m1", "-5", "1.5h", "m10", "10 minutes", "2h,5m"])
+def test_invalid_durations(text):
+    with pytest.raises(ValueError):
+        parse_duration(text)
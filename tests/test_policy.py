@@ -0,0 +1,78 @@
+import pytest
+from aiogram.types import Message
+
+from policy import ANY, ChatPolicy, content_class, sender_class
+
+GROUP = {"id": -100, "type": "supergroup", "title": "group"}
+MEMBER = {"id": 7, "is_bot": False, "first_name": "member"}
+
+
+def message(**fields) -> Message:
+    fields.setdefault("from", MEMBER)
+    return Message(message_id=1, date=0, chat=GROUP, **fields)
+
+
+def test_specific_rule_beats_everything():
+    policy = ChatPolicy({("media", "admin"): 5, ("media", ANY): 600, (ANY, "admin"): None, (ANY, ANY): 60})
+    assert policy.ttl_for("media", "admin", default=30) == 5
+
+
+def test_sender_rule_beats_content_rule():
+    policy = ChatPolicy({("media", ANY): 600, (ANY, "admin"): None})
+    assert policy.ttl_for("media", "admin", default=30) is None
+    assert policy.ttl_for("media", "member", default=30) == 600
+
+
+def test_content_rule_beats_catch_all():
+    policy = ChatPolicy({("command", ANY): 10, (ANY, ANY): 3600})
+    assert policy.ttl_for("command", "bot", default=30) == 10
+    assert policy.ttl_for("text", "bot", default=30) == 3600
+
+
+def test_uncovered_pairs_use_the_default():
+    policy = ChatPolicy({("media", "bot"): 10})
+    assert policy.ttl_for("text", "member", default=45) == 45
+
+
+def test_changes_recompile_the_table():
+    policy = ChatPolicy()
+    policy.set_rule("media", ANY, 600)
+    assert policy.ttl_for("media", "member", default=60) == 600
+    assert policy.remove_rule("media", ANY)
+    assert not policy.remove_rule("media", ANY)
+    assert policy.ttl_for("media", "member", default=60) == 60
+
+
+def test_admin_lookups_only_when_a_rule_targets_admins():
+    policy = ChatPolicy({("media", ANY): 600})
+    assert not policy.uses_admins
+    policy.set_rule(ANY, "admin", None)
+    assert policy.uses_admins
+
+
+@pytest.mark.parametrize("content, sender", [("video", ANY), (ANY, "moderator")])
+def test_unknown_classes_are_rejected(content, sender):
+    with pytest.raises(ValueError):
+        ChatPolicy().set_rule(content, sender, 60)
+
+
+def test_content_classes():
+    command = [{"type": "bot_command", "offset": 0, "length": 6}]
+    assert content_class(message(text="/purge", entities=command)) == "command"
+    assert content_class(message(text="/not a command")) == "text"
+    assert content_class(message(text="hello")) == "text"
+    photo = [{"file_id": "f", "file_unique_id": "u", "width": 1, "height": 1}]
+    assert content_class(message(photo=photo)) == "media"
+    assert content_class(message(new_chat_title="renamed")) == "service"
+    assert content_class(message(dice={"emoji": "🎲", "value": 3})) == "other"
+
+
+def test_sender_classes():
+    assert sender_class(message(text="x")) == "member"
+    assert sender_class(message(text="x"), admin_ids=frozenset({7})) == "admin"
+    bot = {"id": 8, "is_bot": True, "first_name": "bot"}
+    assert sender_class(message(text="x", **{"from": bot})) == "bot"
+    # Anonymous admins post as the group, channels as themselves
+    assert sender_class(message(text="x", sender_chat=GROUP)) == "admin"
+    channel = {"id": -200, "type": "channel", "title": "channel"}
+    assert sender_class(message(text="x", sender_chat=channel)) == "channel"
@@ -0,0 +1,66 @@
+import asyncio
+
+import pytest
+
+from ratelimit import RateLimiter, TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    async def sleep(self, delay: float):
+        self.now += delay
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+def test_bucket_allows_a_burst_then_paces(clock):
+    bucket = TokenBucket(rate=2, burst=3, clock=clock)
+    for _ in range(3):
+        assert bucket.delay() == 0
+        bucket.take()
+    assert bucket.delay() == pytest.approx(0.5)
+
+
+def test_bucket_refills_up_to_the_burst(clock):
+    bucket = TokenBucket(rate=2, burst=3, clock=clock)
+    for _ in range(3):
+        bucket.take()
+    clock.now += 10
+    assert bucket.delay() == 0
+    assert bucket.tokens == 3
+
+
+def test_limiter_waits_for_the_slower_bucket(clock):
+    slept = []
+
+    async def sleep(delay):
+        slept.append(delay)
+        await clock.sleep(delay)
+
+    limiter = RateLimiter(rate=100, burst=100, per_key_rate=1, per_key_burst=2, clock=clock, sleep=sleep)
+
+    async def acquire_three():
+        for _ in range(3):
+            await limiter.acquire(-100)
+
+    asyncio.run(acquire_three())
+    # The chat's bucket holds two tokens, the third one takes a second
+    assert slept == [pytest.approx(1.0)]
+
+
+def test_sweep_drops_only_refilled_buckets(clock):
+    limiter = RateLimiter(per_key_rate=1, per_key_burst=2, clock=clock, sleep=clock.sleep)
+    asyncio.run(limiter.acquire(1))
+    clock.now += 0.5
+    asyncio.run(limiter.acquire(2))
+    clock.now += 0.6
+    limiter.sweep()
+    assert list(limiter._buckets) == [2]
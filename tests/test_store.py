@@ -0,0 +1,38 @@
+import sqlite3
+
+from store import StateStore
+
+
+def test_writer_retries_a_batch_the_database_refused(tmp_path):
+    store = StateStore(str(tmp_path / "state.db"))
+    commit = store._commit
+    refusals = [sqlite3.OperationalError("database is locked")]
+
+    def flaky_commit(writes):
+        if refusals:
+            raise refusals.pop()
+        commit(writes)
+
+    store._commit = flaky_commit
+    store.start_writer()
+    store.add_deletion(-100, 1, 50.0)
+    store.add_deletion(-100, 2, 60.0)
+    store.stop_writer()
+
+    assert not refusals
+    assert store.load_deletions() == [(-100, 1, 50.0), (-100, 2, 60.0)]
+    store.close()
+
+
+def test_writer_drops_only_a_rejected_write(tmp_path):
+    store = StateStore(str(tmp_path / "state.db"))
+    store.start_writer()
+    store.add_deletion(-100, 1, 50.0)
+    # NOT NULL constraint: the database rejects this write on every attempt
+    store.save_settings(-100, True, None)
+    store.add_deletion(-100, 2, 60.0)
+    store.stop_writer()
+
+    assert store.load_deletions() == [(-100, 1, 50.0), (-100, 2, 60.0)]
+    assert store.load_settings() == {}
+    store.close()